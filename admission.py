@@ -0,0 +1,37 @@
+import os
+
+import psutil
+
+from runmetrics import process_tree_rss
+
+class AdmissionController:
+    def __init__(self, min_available_memory=1024 * 1024 * 1024, max_load=1.5, scraper_rss_estimate=600 * 1024 * 1024):
+        self.min_available_memory = min_available_memory
+        self.max_load = max_load
+        self.scraper_rss_estimate = scraper_rss_estimate
+        self.cpu_count = os.cpu_count() or 1
+
+    def get_expected_rss(self, task_pids):
+        # task_pids holds the root pids of each running scraper, idle workers and pooled browsers are not counted
+        if len(task_pids) == 0:
+            return self.scraper_rss_estimate
+        rss = sum(process_tree_rss(pids) for pids in task_pids)
+        return max(self.scraper_rss_estimate, rss / len(task_pids))
+
+    def check(self, scrapers_running, task_pids):
+        # returns None when another scraper may start, otherwise the kind of shortage ("load" or "memory") and a message
+        if scrapers_running == 0:
+            return None
+
+        if self.max_load > 0:
+            load = os.getloadavg()[0] / self.cpu_count
+            if load > self.max_load:
+                return ("load", "load average %.2f per CPU is above %.2f" % (load, self.max_load))
+
+        if self.min_available_memory > 0:
+            available = psutil.virtual_memory().available
+            expected_rss = self.get_expected_rss(task_pids)
+            if available - expected_rss < self.min_available_memory:
+                return ("memory", "%d MB available, a scraper needs about %d MB and %d MB must stay free" % (available / (1024 * 1024), expected_rss / (1024 * 1024), self.min_available_memory / (1024 * 1024)))
+
+        return None
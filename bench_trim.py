@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import argparse
+
+from PIL import Image, ImageChops
+
+from imageutil import trim
+from buildutil import get_build_folder
+
+def legacy_trim(im, depth=0):
+    if depth == 3:
+        return im
+    bg = Image.new(im.mode, im.size, (255, 255, 255))
+    diff = ImageChops.difference(im, bg)
+    diff = ImageChops.add(diff, diff, 2.0, -100)
+    bbox = diff.getbbox()
+    if bbox:
+        return im.crop(bbox)
+    else:
+        return legacy_trim(im.convert('RGB'), depth+1)
+
+def find_images(path, limit):
+    image_paths = []
+    for root, directories, files in os.walk(path):
+        for file in files:
+            if os.path.splitext(file)[1].lower() in [".png", ".jpg", ".jpeg", ".webp"]:
+                image_paths.append(os.path.join(root, file))
+                if len(image_paths) == limit:
+                    return image_paths
+    return image_paths
+
+def bench(function, images, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for im in images:
+            function(im)
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(
+                    prog = "newswall trim benchmark",
+                    description = "Compares imageutil.trim against the PIL ImageChops chain previously copied into each site module.")
+    parser.add_argument("path", action="store", type=str, nargs="?", default=get_build_folder("images"), help="Folder of captured screenshots to benchmark against")
+    parser.add_argument("-l", "--limit", dest="limit", action="store", type=int, default=200, help="Maximum number of images to load")
+    parser.add_argument("-r", "--repeat", dest="repeat", action="store", type=int, default=5, help="Number of passes over the images")
+    args = parser.parse_args()
+
+    images = []
+    for image_path in find_images(args.path, args.limit):
+        im = Image.open(image_path)
+        im.load()
+        images.append(im)
+
+    if len(images) == 0:
+        print("No images found in %s" % args.path)
+        sys.exit(1)
+
+    mismatches = sum(1 for im in images if legacy_trim(im).size != trim(im).size)
+    legacy_time = bench(legacy_trim, images, args.repeat)
+    numpy_time = bench(trim, images, args.repeat)
+    calls = len(images) * args.repeat
+
+    print("%d images, %d passes" % (len(images), args.repeat))
+    print("PIL ImageChops: %.3f ms/image" % (legacy_time * 1000 / calls))
+    print("imageutil:      %.3f ms/image" % (numpy_time * 1000 / calls))
+    print("speedup:        %.2fx" % (legacy_time / numpy_time))
+    print("size mismatches: %d" % mismatches)
+
+if __name__ == "__main__":
+    main()
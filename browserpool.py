@@ -0,0 +1,143 @@
+import os
+import shutil
+import threading
+import time
+
+from collections import OrderedDict
+
+from runmetrics import browser_pids, process_tree_rss
+
+class PooledBrowser:
+    def __init__(self, site, driver, xdotool, vdisplay, user_data_directory, cleanup_user_data_directory=False):
+        self.site = site
+        self.driver = driver
+        self.xdotool = xdotool
+        self.vdisplay = vdisplay
+        self.user_data_directory = user_data_directory
+        self.cleanup_user_data_directory = cleanup_user_data_directory
+        self.runs = 0
+        self.created = time.time()
+        self.idle_since = None
+
+    def pids(self):
+        return browser_pids(self.driver)
+
+    def rss(self):
+        return process_tree_rss(self.pids())
+
+class BrowserPool:
+    def __init__(self, max_runs=20, max_rss=1536 * 1024 * 1024, max_idle=4, idle_ttl=900, log_func=print):
+        self.max_runs = max_runs
+        self.max_rss = max_rss
+        self.max_idle = max_idle
+        self.idle_ttl = idle_ttl
+        self.log_func = log_func
+        # least recently released first
+        self.idle = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take_expired(self):
+        expired = []
+        now = time.time()
+        for site, browser in list(self.idle.items()):
+            if now - browser.idle_since > self.idle_ttl:
+                expired.append(self.idle.pop(site))
+        return expired
+
+    def lease(self, site):
+        with self.lock:
+            expired = self.take_expired()
+            browser = self.idle.pop(site, None)
+
+        for expired_browser in expired:
+            self.log_func("Closing browser for '%s' after %ds idle" % (expired_browser.site, time.time() - expired_browser.idle_since))
+            self.destroy(expired_browser)
+
+        if browser == None:
+            return None
+
+        if not self.healthy(browser):
+            self.log_func("Pooled browser for '%s' failed its health check" % site)
+            self.destroy(browser)
+            return None
+
+        return browser
+
+    def release(self, browser):
+        browser.runs += 1
+
+        if browser.runs >= self.max_runs:
+            self.log_func("Recycling browser for '%s' after %d runs" % (browser.site, browser.runs))
+            self.destroy(browser)
+            return False
+
+        rss = browser.rss()
+        if rss > self.max_rss:
+            self.log_func("Recycling browser for '%s' at %d MB RSS" % (browser.site, rss / (1024 * 1024)))
+            self.destroy(browser)
+            return False
+
+        try:
+            browser.driver.get("about:blank")
+        except:
+            self.destroy(browser)
+            return False
+
+        browser.idle_since = time.time()
+        evicted = []
+        with self.lock:
+            previous_browser = self.idle.pop(browser.site, None)
+            if previous_browser != None:
+                evicted.append(previous_browser)
+            self.idle[browser.site] = browser
+            expired = self.take_expired()
+            while len(self.idle) > self.max_idle:
+                evicted.append(self.idle.popitem(last=False)[1])
+            kept = self.idle.get(browser.site, None) is browser
+
+        for expired_browser in expired:
+            self.log_func("Closing browser for '%s' after %ds idle" % (expired_browser.site, browser.idle_since - expired_browser.idle_since))
+            self.destroy(expired_browser)
+        for evicted_browser in evicted:
+            if evicted_browser is not previous_browser:
+                self.log_func("Evicting least recently used idle browser for '%s' (limit %d)" % (evicted_browser.site, self.max_idle))
+            self.destroy(evicted_browser)
+        return kept
+
+    def healthy(self, browser):
+        try:
+            browser.driver.current_url
+            return True
+        except:
+            return False
+
+    def destroy(self, browser):
+        browser.xdotool.close()
+
+        for pid in browser.pids():
+            try:
+                os.kill(pid, 9)
+            except:
+                pass
+
+        try:
+            browser.driver.quit()
+        except:
+            pass
+
+        if browser.vdisplay != None:
+            try:
+                browser.vdisplay.stop()
+            except:
+                pass
+
+        if browser.cleanup_user_data_directory:
+            shutil.rmtree(browser.user_data_directory, ignore_errors=True, onerror=None)
+
+    def close(self):
+        with self.lock:
+            browsers = list(self.idle.values())
+            self.idle = OrderedDict()
+
+        for browser in browsers:
+            self.destroy(browser)
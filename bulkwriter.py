@@ -0,0 +1,79 @@
+import time
+import threading
+import traceback
+
+from contextlib import nullcontext
+
+from pymongo import InsertOne, UpdateOne
+
+class BulkWriter:
+    def __init__(self, collection, batch_size=100, flush_interval=5, flush_context=nullcontext, periodic=False, log_func=None):
+        self.collection = collection
+        # wraps every write, including the ones insert() and push() trigger when a batch is due
+        self.flush_context = flush_context
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.log_func = log_func
+        self.operations = []
+        self.pending_inserts = {}
+        self.last_flush = time.time()
+        # held across bulk_write, so a push never races the insert it belongs to
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        self.thread = None
+        if periodic:
+            # a killed run skips the final flush, flushing on a timer bounds what it loses to flush_interval
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def insert(self, document):
+        with self.lock:
+            self.operations.append(InsertOne(document))
+            self.pending_inserts[document["_id"]] = document
+            self.flush_if_due()
+
+    def push(self, id, field, value):
+        with self.lock:
+            # the insert is still buffered, so add the value to the document instead of racing it with an update
+            if id in self.pending_inserts:
+                document = self.pending_inserts[id]
+                if not field in document:
+                    document[field] = []
+                document[field].append(value)
+                return
+
+            self.operations.append(UpdateOne({"_id": id}, {"$push": {field: value}}))
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        with self.lock:
+            if len(self.operations) >= self.batch_size or (time.time() - self.last_flush) >= self.flush_interval:
+                return self.flush()
+            return None
+
+    def flush(self):
+        with self.lock:
+            self.last_flush = time.time()
+            if len(self.operations) == 0:
+                return None
+
+            operations = self.operations
+            self.operations = []
+            self.pending_inserts = {}
+            with self.flush_context():
+                return self.collection.bulk_write(operations, ordered=False)
+
+    def run(self):
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                self.flush_if_due()
+            except Exception as e:
+                if self.log_func != None:
+                    self.log_func("Periodic report flush failed: %s" % (str(e)), exception=traceback.format_exc())
+
+    def close(self):
+        if self.thread == None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
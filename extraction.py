@@ -0,0 +1,91 @@
+# A site describes what it wants as a list of specs:
+#
+#   {
+#       "selector": ".athing",
+#       "fields": {
+#           "url": {"selector": ".titleline > a", "property": "href"},
+#           "age": {"root": "next", "selector": ".age", "attribute": "title"},
+#           "post": {"root": "next", "element": True}
+#       }
+#   }
+#
+# and every item of every spec comes back from one execute_script call as
+# {"element": WebElement, "rect": [x, y, width, height], "fields": {...}}.
+# rect is in document coordinates and can be passed to Helper.sync_rect_screenshot with the element,
+# so capturing an item needs no further round trip to measure it unless the page has to scroll.
+#
+# Field options:
+#   selector  CSS selector (or list of selectors, first match wins) relative to the root, omit for the root itself
+#   root      "item" (default) or "next" for the item's next element sibling
+#   index     pick from querySelectorAll instead of querySelector, negative counts from the end
+#   sibling   "next" to take the matched node's next sibling node
+#   property  DOM property to read, defaults to innerText
+#   attribute attribute to read instead of a property
+#   element   return the matched WebElement instead of a value
+# Fields that do not match resolve to None.
+
+EXTRACT_SCRIPT = """
+var specs = arguments[0];
+
+function resolve(root, field) {
+    if (field.root === "next") {
+        root = root.nextElementSibling;
+    }
+    if (!root) {
+        return null;
+    }
+
+    var node = root;
+    if (field.selector) {
+        var selectors = Array.isArray(field.selector) ? field.selector : [field.selector];
+        node = null;
+        for (var i = 0; i < selectors.length && node === null; i++) {
+            if (field.index !== undefined && field.index !== null) {
+                var nodes = root.querySelectorAll(selectors[i]);
+                var index = field.index < 0 ? nodes.length + field.index : field.index;
+                node = nodes[index] || null;
+            } else {
+                node = root.querySelector(selectors[i]);
+            }
+        }
+    }
+
+    if (node && field.sibling === "next") {
+        node = node.nextSibling;
+    }
+    if (!node) {
+        return null;
+    }
+
+    if (field.element) {
+        return node;
+    }
+    if (field.attribute) {
+        return node.getAttribute ? node.getAttribute(field.attribute) : null;
+    }
+
+    var value = node[field.property || "innerText"];
+    if (value === undefined || (typeof value === "object" && value !== null)) {
+        return null;
+    }
+    return value;
+}
+
+return specs.map(function (spec) {
+    return Array.from(document.querySelectorAll(spec.selector), function (item) {
+        var rect = item.getBoundingClientRect();
+        var fields = {};
+        for (var name in spec.fields) {
+            fields[name] = resolve(item, spec.fields[name]);
+        }
+        return {
+            element: item,
+            rect: [rect.left + window.scrollX, rect.top + window.scrollY, item.offsetWidth, item.offsetHeight],
+            fields: fields
+        };
+    });
+});
+"""
+
+def extract(driver, specs):
+    return driver.execute_script(EXTRACT_SCRIPT, specs)
@@ -6,12 +6,28 @@ import time
 import os
 import datetime
 import shutil
+import hashlib
+import socket
+import traceback
 
 import uc
 
+from bson.objectid import ObjectId
 from xvfbwrapper import Xvfb
 
 from xdotool import XdotoolWrapper
+from xinput import create_input
+from bulkwriter import BulkWriter
+from logsink import LogSink
+from screenshots import ScreenshotService
+from imagesink import ImageSink
+from extraction import extract
+from scrolling import scroll_to_bottom
+from readiness import NetworkIdleTracker, wait_until_ready
+from browserpool import PooledBrowser
+from runmetrics import PeakRssSampler, browser_pids
+from phases import PhaseTimer, timed_method
+from profiling import get_run_directory
 
 from buildutil import get_build_var, get_build_folder, get_config_path, get_build_root
 
@@ -21,6 +37,9 @@ config_path = get_config_path()
 profiles_folder = get_build_folder("profiles")
 images_folder = get_build_folder("images")
 
+def report_id_from_url(url):
+    return hashlib.sha256(url.encode("ascii")).hexdigest()
+
 class Helper:
     def __init__(self,
             id,
@@ -30,10 +49,25 @@ class Helper:
             disable_xvfb=False,
             start_detached=False,
             random_user_data_directory=False,
-            cleanup_user_data_directory=False):
+            cleanup_user_data_directory=False,
+            report_batch_size=100,
+            report_flush_interval=5,
+            log_queue_size=10000,
+            log_queue_block=False,
+            options={},
+            browser_pool=None,
+            profile_suffix=None):
         self.id = id
         self.name = name
         self.uc = None
+        self.driver = None
+        self.xdotool = None
+        self.vdisplay = None
+        self.screenshots = None
+        self.browser_pool = browser_pool
+        self.pooled_browser = None
+        self.reused_browser = False
+        self.profile_suffix = profile_suffix
         self.sync_mongodb_database = sync_mongodb_database
         self.page_scroll_interval = 0.5
         self.sigkill_child_processes = sigkill_child_processes
@@ -41,18 +75,44 @@ class Helper:
         self.start_detached = start_detached
         self.random_user_data_directory = random_user_data_directory
         self.cleanup_user_data_directory = cleanup_user_data_directory
+        self.options = options
         self.run_identifier = uuid.uuid4()
+        self.run_started = datetime.datetime.utcnow()
+        self.discovered_report_ids = set()
+        self.exceptions_logged = 0
+        self.failed = False
+        self.phases = PhaseTimer()
+        self.profile_paths = None
+        self.network_tracker = NetworkIdleTracker()
+        self.rss_sampler = PeakRssSampler(lambda: browser_pids(self.driver) if self.driver != None else [])
+        self.known_reports = {}
+        self.checked_report_ids = set()
+        self.reports_inserted = 0
+        self.presences_inserted = 0
+        self.report_writer = BulkWriter(self.sync_mongodb_database[self.id],
+            batch_size=report_batch_size,
+            flush_interval=report_flush_interval,
+            flush_context=lambda: self.phases.phase("mongo_write"),
+            periodic=True,
+            log_func=self.log)
+        self.log_sink = LogSink(self.sync_mongodb_database["log"],
+            max_queue_size=log_queue_size,
+            block=log_queue_block)
+        self.image_sink = ImageSink.from_options(self.options, log_func=self.log)
     
     def interval(self):
         return random.randrange(0, 3600)
     
     def interval_page_ready(self):
-        return random.randrange(30, 120)
+        # an upper bound now, sync_wait_until_ready returns as soon as the page is ready
+        return 60
     
     def interval_page_scroll(self):
         return 0.25
 
-    def get_image_path(self, id, ext="png"):
+    def get_image_path(self, id, ext=None):
+        if ext == None:
+            ext = self.image_sink.extension()
         site_images_folder = os.path.join(images_folder, self.id)
         if not os.path.exists(images_folder): os.mkdir(images_folder)
         if not os.path.exists(site_images_folder): os.mkdir(site_images_folder)
@@ -66,13 +126,39 @@ class Helper:
     def get_user_data_directory_path(self):
         if self.random_user_data_directory:
             return os.path.join(profiles_folder, str(self.run_identifier))
+        elif self.profile_suffix != None:
+            return os.path.join(profiles_folder, "%s-%s" % (self.id, self.profile_suffix))
         else:
             return os.path.join(profiles_folder, self.id)
 
     def rmtree_user_data_directory(self):
         shutil.rmtree(self.get_user_data_directory_path(), ignore_errors=True, onerror=None)
 
+    @timed_method("stop")
     def stop(self):
+        self.image_sink.close()
+        self.report_writer.close()
+        self.sync_flush_reports()
+        self.sync_record_churn()
+        self.sync_record_run()
+
+        try:
+            self.stop_browser()
+        finally:
+            self.log_sink.close()
+
+    def stop_browser(self):
+        if self.pooled_browser != None:
+            pooled_browser = self.pooled_browser
+            self.pooled_browser = None
+            self.driver = None
+            if self.browser_pool.release(pooled_browser):
+                self.log("Returned browser to the pool after %d runs" % pooled_browser.runs)
+            return
+
+        if self.xdotool != None:
+            self.xdotool.close()
+
         if not self.disable_xvfb:
             try:
                 self.vdisplay.stop()
@@ -93,9 +179,6 @@ class Helper:
                 self.rmtree_user_data_directory()
             return
 
-        if getattr(self, "driver") == None:
-            return
-
         if self.driver == None:
             return
 
@@ -119,7 +202,46 @@ class Helper:
         if self.cleanup_user_data_directory:
             self.rmtree_user_data_directory()
 
+    @timed_method("ready")
+    def sync_wait_until_ready(self, locator=None, timeout=None, idle_time=None, max_inflight=None):
+        ready_options = self.options.get("ready", {})
+        if timeout == None:
+            timeout = self.interval_page_ready()
+        reason, elapsed = wait_until_ready(self.driver,
+            self.network_tracker,
+            locator=locator,
+            timeout=timeout,
+            idle_time=idle_time if idle_time != None else ready_options.get("idle_time", 0.5),
+            max_inflight=max_inflight if max_inflight != None else ready_options.get("max_inflight", 2))
+        self.log("Page ready after %.1fs (%s)" % (elapsed, reason))
+        return reason
+
+    def sync_wait_for_network_idle(self, timeout=10):
+        return self.sync_wait_until_ready(timeout=timeout)
+
+    @timed_method("scroll")
     def scroll_down_page(self, scrolls=1):
+        self.screenshots.invalidate()
+        scroll_options = self.options.get("scroll", {})
+        if scroll_options.get("mode", "observer") == "wheel":
+            return self.scroll_down_page_wheel(scrolls)
+
+        self.log("Scrolling down the page in the browser")
+        try:
+            result = scroll_to_bottom(self.driver,
+                quiet_period=scroll_options.get("quiet_period", 1.0),
+                max_duration=scroll_options.get("max_duration", 30),
+                step_interval=scroll_options.get("step_interval", 0.15),
+                max_stuck_steps=scroll_options.get("max_stuck_steps", 10),
+                max_settle=scroll_options.get("max_settle", 5))
+        except Exception as e:
+            self.log("In-page scrolling failed, scrolling with the mouse wheel: %s" % (str(e)), exception=traceback.format_exc())
+            return self.scroll_down_page_wheel(scrolls)
+
+        self.log("Scrolling %s after %dms: %d steps, %d mutations, %d lazy images forced, %d still loading, height %d" % (result["reason"], result["duration"], result["steps"], result["mutations"], result["forced_images"], result["pending_images"], result["height"]))
+        return result
+
+    def scroll_down_page_wheel(self, scrolls=1):
         self.log("Scrolling down the page")
         page_height = self.driver.execute_script("return document.body.scrollHeight")
         browser_height = self.driver.get_window_size()["height"]
@@ -156,7 +278,22 @@ class Helper:
 
             last_scroll_y = scroll_y
 
+    @timed_method("setup")
     def sync_uc(self, headless=False):
+        if self.browser_pool != None:
+            pooled_browser = self.browser_pool.lease(self.id)
+            if pooled_browser != None:
+                self.sync_log("Leased pooled browser (%d previous runs)" % pooled_browser.runs)
+                self.pooled_browser = pooled_browser
+                self.reused_browser = True
+                self.driver = pooled_browser.driver
+                self.xdotool = pooled_browser.xdotool
+                self.vdisplay = pooled_browser.vdisplay
+                self.screenshots = ScreenshotService.from_options(self.driver, self.options)
+                self.phases.count_round_trips(self.driver)
+                self.rss_sampler.start()
+                return self.xdotool, self.driver
+
         options = uc.ChromeOptions()
         options.add_argument("--disable-breakpad")
         options.add_argument("--noerrdialogs")
@@ -166,6 +303,9 @@ class Helper:
         if headless:
             options.headless = True
             options.add_argument("--headless")
+        # get() returns at DOMContentLoaded, sync_wait_until_ready decides when the page is usable
+        options.page_load_strategy = "eager"
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
 
         if not self.disable_xvfb:
             self.vdisplay = Xvfb(width=1920, height=1080)
@@ -183,44 +323,229 @@ class Helper:
             display=display,
             use_subprocess=(not self.start_detached))
 
-        # find the window ID for this window
+        # find the window by the browser's pid, the window finder page is only needed when that fails
+        try:
+            xdotool = create_input(display, driver.browser_pid, log_func=self.sync_log)
+        except Exception as e:
+            self.sync_log("Failed to find the window by pid: %s" % (str(e)))
+            xdotool = XdotoolWrapper(display, self.sync_open_window_finder(driver))
+        self.sync_log("%s created, window: %d" % (type(xdotool).__name__, xdotool.window_id))
+
+        self.driver = driver
+        self.xdotool = xdotool
+        self.screenshots = ScreenshotService.from_options(driver, self.options)
+        self.phases.count_round_trips(driver)
+
+        if self.browser_pool != None:
+            self.pooled_browser = PooledBrowser(self.id,
+                driver,
+                xdotool,
+                None if self.disable_xvfb else self.vdisplay,
+                self.get_user_data_directory_path(),
+                cleanup_user_data_directory=self.cleanup_user_data_directory)
+
+        self.rss_sampler.start()
+        return xdotool, driver
+
+    def sync_open_window_finder(self, driver):
         window_uuid = uuid.uuid4()
         window_uuid_str = str(window_uuid)
         self.sync_log("uuid: %s" % window_uuid_str)
         html_with_uuid_title = "<!DOCTYPE html><html><head><title>" + window_uuid_str + "</title></head><body></body></html>"
-        self.sync_log("uuidhtml: %s" % html_with_uuid_title)
         window_uuid_url = "data:text/html;charset=utf-8;base64," + base64.b64encode(html_with_uuid_title.encode("ASCII")).decode('ASCII')
-        self.sync_log("uuidurl: %s" % window_uuid_url)
         driver.get(window_uuid_url)
         self.sync_log("Navigated to window finder data URL")
-        xdotool = XdotoolWrapper(display, window_uuid)
-        self.sync_log("XdotoolWrapper created, window: %d" % (xdotool.window_id))
+        return window_uuid
 
-        self.driver = driver
-        self.xdotool = xdotool
+    def sync_element_rect(self, element, computed_size=False):
+        return self.screenshots.element_rect(element, computed_size=computed_size)
 
-        return xdotool, driver
+    def sync_elements_rect(self, elements, computed_size=False):
+        return self.screenshots.elements_rect(elements, computed_size=computed_size)
+
+    @timed_method("screenshot")
+    def sync_viewport_screenshot(self):
+        return self.screenshots.viewport()
+
+    def sync_prefetch_element_rects(self, elements, computed_size=False):
+        return self.screenshots.prefetch_rects(elements, computed_size=computed_size)
 
+    def sync_invalidate_screenshots(self):
+        return self.screenshots.invalidate()
+
+    @timed_method("screenshot")
+    def sync_region_screenshot(self, box):
+        return self.screenshots.region(box)
+
+    @timed_method("screenshot")
+    def sync_element_screenshot(self, element, computed_size=False):
+        return self.screenshots.element(element, computed_size=computed_size)
+
+    @timed_method("screenshot")
+    def sync_rect_screenshot(self, element, rect):
+        return self.screenshots.rect_region(element, rect)
+
+    @timed_method("extract")
+    def sync_extract(self, specs):
+        # the returned rects describe the page as it is now, so earlier captures and scroll state no longer apply
+        if self.screenshots != None:
+            self.screenshots.invalidate()
+        if type(specs) == dict:
+            return extract(self.driver, [specs])[0]
+        return extract(self.driver, specs)
+
+    @timed_method("image_queue")
+    def save_image(self, im, file, trim=False):
+        return self.image_sink.submit(im, file, trim=trim)
+
+    @timed_method("mongo_lookup")
+    def sync_find_known_reports(self, ids):
+        ids = set(ids)
+        unchecked_ids = ids - self.checked_report_ids
+        if len(unchecked_ids) > 0:
+            cursor = self.sync_mongodb_database[self.id].find({"report_id": {"$in": list(unchecked_ids)}}, {"_id": 1, "report_id": 1})
+            for report in cursor:
+                self.known_reports[report["report_id"]] = report
+            self.checked_report_ids.update(unchecked_ids)
+        return set(id for id in ids if id in self.known_reports)
+
+    @timed_method("prefetch")
+    def sync_prefetch_known_reports(self, selector="a[href]", attribute=None):
+        # collect every candidate on the page in one round trip, then dedup with one $in query
+        if attribute == None:
+            values = self.driver.execute_script("return Array.from(document.querySelectorAll(arguments[0]), function (element) { return element.href; })", selector)
+        else:
+            values = self.driver.execute_script("var attribute = arguments[1]; return Array.from(document.querySelectorAll(arguments[0]), function (element) { return element.getAttribute(attribute); })", selector, attribute)
+
+        ids = set()
+        for value in values:
+            if type(value) != str or value == "":
+                continue
+            if attribute != None:
+                ids.add(value)
+                continue
+            try:
+                ids.add(report_id_from_url(value))
+            except UnicodeEncodeError:
+                pass
+
+        known_ids = self.sync_find_known_reports(ids)
+        self.log("Prefetched %d report IDs, %d already known" % (len(ids), len(known_ids)))
+        return known_ids
+
+    @timed_method("mongo_lookup")
     def sync_find_if_exists(self, id):
+        self.discovered_report_ids.add(id)
+        if id in self.known_reports:
+            return self.known_reports[id]
+        if id in self.checked_report_ids:
+            return None
         return self.sync_mongodb_database[self.id].find_one({"report_id": id})
 
     def sync_report(self, id, data):
-        return self.sync_mongodb_database[self.id].insert_one({"report_id": id, "report_date": datetime.datetime.utcnow(), **data})
+        report = {"_id": ObjectId(), "report_id": id, "report_date": datetime.datetime.utcnow(), **data}
+        self.report_writer.insert(report)
+        self.known_reports[id] = {"_id": report["_id"], "report_id": id}
+        self.discovered_report_ids.add(id)
+        self.reports_inserted += 1
+        # buffered, it reaches MongoDB with the next flush
+        return report["_id"]
     
     def sync_insert_presence(self, db_id, date):
-        return self.sync_mongodb_database[self.id].update_one({"_id": db_id}, {"$push": {"presence": date}})
+        self.presences_inserted += 1
+        return self.report_writer.push(db_id, "presence", date)
 
-    def log(self, message, exception=None):
-        return self.sync_log(message, exception=exception)
+    @timed_method("mongo_write")
+    def sync_flush_reports(self):
+        try:
+            result = self.report_writer.flush()
+        except Exception as e:
+            self.log("Failed to flush reports: %s" % (str(e)), exception=traceback.format_exc())
+            return None
+
+        if result != None:
+            self.log("Flushed reports: %d inserted, %d presence updates" % (result.inserted_count, result.modified_count))
+        return result
+
+    def sync_record_churn(self):
+        # read back by ScraperScheduler to adapt this site's interval
+        try:
+            self.sync_mongodb_database["schedule"].update_one({"_id": self.id}, {"$set": {
+                "last_run_identifier": str(self.run_identifier),
+                "last_run_date": datetime.datetime.utcnow(),
+                "last_run_new": self.reports_inserted,
+                "last_run_seen": self.presences_inserted
+            }}, upsert=True)
+        except Exception as e:
+            self.log("Failed to record churn: %s" % (str(e)), exception=traceback.format_exc())
+
+    def sync_record_run(self, outcome=None):
+        # one document per run in `runs`, called again by the manager once the outcome is known
+        run_finished = datetime.datetime.utcnow()
+        run = {
+            "site": self.id,
+            "host": socket.gethostname(),
+            "started": self.run_started,
+            "finished": run_finished,
+            "wall_time": (run_finished - self.run_started).total_seconds(),
+            "articles_discovered": len(self.discovered_report_ids),
+            "new_reports": self.reports_inserted,
+            "presence_updates": self.presences_inserted,
+            "screenshots": self.screenshots.captures if self.screenshots != None else 0,
+            "screenshot_bytes": self.screenshots.bytes_captured if self.screenshots != None else 0,
+            "images_written": self.image_sink.images_written,
+            "bytes_written": self.image_sink.bytes_written,
+            "peak_rss": self.rss_sampler.stop(),
+            "reused_browser": self.reused_browser,
+            "round_trips": self.phases.round_trips,
+            "phases": self.phases.summary(),
+            "exceptions_logged": self.exceptions_logged
+        }
+        if outcome != None:
+            run["outcome"] = outcome
+        if self.profile_paths != None:
+            run["profile"] = self.profile_paths
+
+        try:
+            self.sync_mongodb_database["runs"].update_one({"_id": str(self.run_identifier)}, {"$set": run}, upsert=True)
+        except Exception as e:
+            self.log("Failed to record run: %s" % (str(e)), exception=traceback.format_exc())
 
-    def sync_log(self, message, exception=None):
+    def get_outcome(self):
+        # sites catch their own exceptions, so returning from start() does not mean the run went well;
+        # only fatal failures count, sites also log tracebacks for things they recover from
+        if self.failed:
+            return "error"
+        return "success"
+
+    def save_profile(self, profiler):
+        try:
+            self.profile_paths = profiler.save(get_run_directory(self.id, self.run_identifier))
+            self.log("Saved profile of %d samples over %ds: %s" % (profiler.samples, profiler.duration, ", ".join(self.profile_paths)))
+        except Exception as e:
+            self.log("Failed to save profile: %s" % (str(e)), exception=traceback.format_exc())
+
+    def phase(self, name):
+        return self.phases.phase(name)
+
+    def timed(self, name=None):
+        return self.phases.timed(name)
+
+    def log(self, message, exception=None, fatal=False):
+        return self.sync_log(message, exception=exception, fatal=fatal)
+
+    def sync_log(self, message, exception=None, fatal=False):
+        if fatal:
+            self.failed = True
         log_line = {"date": datetime.datetime.utcnow(), "source": self.id, "text": message}
         if exception != None:
             log_line["exception"] = exception
+            self.exceptions_logged += 1
 
-        log_id = self.sync_mongodb_database["log"].insert_one(log_line).inserted_id
+        log_id = ObjectId()
         log_line["_id"] = log_id
-        
+        self.log_sink.put(log_line)
+
         print("[%s] [%s] %s" % (log_line["source"], log_line["date"], message))
         if exception != None:
             print(exception)
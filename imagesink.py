@@ -0,0 +1,96 @@
+import os
+import threading
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor
+
+from imageutil import trim as trim_image
+
+IMAGE_FORMATS = {
+    "png": {"pil_format": "PNG", "extension": "png"},
+    "webp": {"pil_format": "WEBP", "extension": "webp"},
+    "jpeg": {"pil_format": "JPEG", "extension": "jpg"}
+}
+
+def default_log_func(message, exception=None):
+    print(message)
+    if exception != None:
+        print(exception)
+
+class ImageSink:
+    def __init__(self,
+            image_format="png",
+            compress_level=6,
+            quality=80,
+            max_workers=2,
+            max_pending=32,
+            log_func=default_log_func):
+        if not image_format in IMAGE_FORMATS:
+            raise ValueError("Unsupported image format '%s'" % image_format)
+        self.image_format = image_format
+        self.compress_level = compress_level
+        self.quality = quality
+        self.log_func = log_func
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+        self.images_written = 0
+        self.bytes_written = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_options(cls, options, log_func=default_log_func):
+        image_options = options.get("image", {})
+        return cls(image_format=image_options.get("format", "png"),
+            compress_level=image_options.get("compress_level", 6),
+            quality=image_options.get("quality", 80),
+            max_workers=image_options.get("workers", 2),
+            max_pending=image_options.get("max_pending", 32),
+            log_func=log_func)
+
+    def extension(self):
+        return IMAGE_FORMATS[self.image_format]["extension"]
+
+    def save_arguments(self):
+        if self.image_format == "png":
+            return {"compress_level": self.compress_level}
+        return {"quality": self.quality}
+
+    def submit(self, im, path, trim=False):
+        # blocks once max_pending images are queued, so a slow disk slows the scraper instead of growing memory
+        self.pending.acquire()
+        try:
+            future = self.executor.submit(self.write, im, path, trim)
+        except:
+            self.pending.release()
+            raise
+        self.futures.append(future)
+        return future
+
+    def write(self, im, path, trim):
+        try:
+            if trim:
+                im = trim_image(im)
+            if self.image_format == "jpeg" and im.mode != "RGB":
+                im = im.convert("RGB")
+            im.save(path, IMAGE_FORMATS[self.image_format]["pil_format"], **self.save_arguments())
+            size = os.path.getsize(path)
+            with self.lock:
+                self.images_written += 1
+                self.bytes_written += size
+            return size
+        except Exception as e:
+            self.log_func("Failed to write image %s: %s" % (path, str(e)), exception=traceback.format_exc())
+            return None
+        finally:
+            self.pending.release()
+
+    def join(self):
+        futures = self.futures
+        self.futures = []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        self.join()
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,29 @@
+import numpy
+
+# matches the old ImageChops chain: a pixel is content when any channel is more than 100 away from white
+TRIM_THRESHOLD = 155
+
+def content_bbox(im, threshold=TRIM_THRESHOLD):
+    if im.mode in ("RGB", "RGBA", "L"):
+        pixels = numpy.asarray(im)
+    else:
+        pixels = numpy.asarray(im.convert("RGB"))
+
+    if pixels.ndim == 3:
+        mask = (pixels[:, :, :3] < threshold).any(axis=2)
+    else:
+        mask = pixels < threshold
+
+    rows = numpy.flatnonzero(mask.any(axis=1))
+    if len(rows) == 0:
+        return None
+    columns = numpy.flatnonzero(mask.any(axis=0))
+    return (int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1)
+
+def trim(im, threshold=TRIM_THRESHOLD):
+    bbox = content_bbox(im, threshold=threshold)
+    if bbox != None:
+        im = im.crop(bbox)
+    if im.mode != "RGB":
+        im = im.convert("RGB")
+    return im
@@ -0,0 +1,118 @@
+import os
+import socket
+import threading
+import time
+
+from pymongo import ReturnDocument, ASCENDING, DESCENDING
+from bson.objectid import ObjectId
+
+def default_node_identifier():
+    return "%s-%d" % (socket.gethostname(), os.getpid())
+
+class JobQueue:
+    def __init__(self, sync_mongodb_database, node_identifier=None, lease_duration=120, heartbeat_interval=30, log_func=print):
+        self.collection = sync_mongodb_database["jobs"]
+        self.node_identifier = node_identifier or default_node_identifier()
+        self.lease_duration = lease_duration
+        self.heartbeat_interval = heartbeat_interval
+        self.log_func = log_func
+        self.leases = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.heartbeat_thread = None
+
+        self.collection.create_index([("next_run", ASCENDING)])
+
+    def register(self, site_identifier, interval, priority, next_run=0):
+        # next_run and lease state are only set when the job is new, so nodes joining later keep the shared schedule
+        # which sites a node runs is its own choice (config, -o), acquire() is only ever given the enabled ones
+        self.collection.update_one({"_id": site_identifier}, {
+            "$set": {"interval": interval, "priority": priority},
+            "$setOnInsert": {"next_run": next_run, "last_run": 0, "runs": 0, "lease_owner": None, "lease_expires": 0, "lease_token": None}
+        }, upsert=True)
+
+    def acquire(self, site_identifiers):
+        now = time.time()
+        lease_token = ObjectId()
+        previous = self.collection.find_one_and_update({
+                "_id": {"$in": list(site_identifiers)},
+                "next_run": {"$lte": now},
+                "$or": [{"lease_owner": None}, {"lease_expires": {"$lt": now}}]
+            },
+            {"$set": {"lease_owner": self.node_identifier, "lease_expires": now + self.lease_duration, "lease_token": lease_token, "leased": now}},
+            sort=[("priority", DESCENDING), ("next_run", ASCENDING)],
+            return_document=ReturnDocument.BEFORE)
+
+        if previous == None:
+            return None
+
+        if previous["lease_owner"] != None:
+            self.log_func("Reclaimed job '%s' from node '%s', its lease expired %ds ago" % (previous["_id"], previous["lease_owner"], now - previous["lease_expires"]))
+
+        with self.lock:
+            self.leases[previous["_id"]] = lease_token
+
+        previous["lease_token"] = lease_token
+        return previous
+
+    def complete(self, site_identifier, next_run):
+        with self.lock:
+            lease_token = self.leases.pop(site_identifier, None)
+        if lease_token == None:
+            return False
+
+        result = self.collection.update_one({"_id": site_identifier, "lease_token": lease_token}, {
+            "$set": {"lease_owner": None, "lease_expires": 0, "lease_token": None, "last_run": time.time(), "next_run": next_run, "last_node": self.node_identifier},
+            "$inc": {"runs": 1}
+        })
+        if result.modified_count == 0:
+            self.log_func("Lease on job '%s' was lost before it completed, another node has reclaimed it" % site_identifier)
+            return False
+        return True
+
+    def heartbeat(self):
+        with self.lock:
+            leases = list(self.leases.items())
+
+        for site_identifier, lease_token in leases:
+            result = self.collection.update_one({"_id": site_identifier, "lease_token": lease_token},
+                {"$set": {"lease_expires": time.time() + self.lease_duration}})
+            if result.matched_count == 0:
+                self.log_func("Lease on job '%s' was lost, another node has reclaimed it" % site_identifier)
+                with self.lock:
+                    if self.leases.get(site_identifier) == lease_token:
+                        del self.leases[site_identifier]
+
+    def run_heartbeat(self):
+        while not self.stopped.wait(self.heartbeat_interval):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                self.log_func("Job lease heartbeat failed: %s" % str(e))
+
+    def start_heartbeat(self):
+        self.heartbeat_thread = threading.Thread(target=self.run_heartbeat, daemon=True)
+        self.heartbeat_thread.start()
+
+    def get_next_due(self, site_identifiers):
+        # a job held by a node counts as due when its lease runs out, it may have to be reclaimed
+        now = time.time()
+        next_due = None
+        for job in self.collection.find({"_id": {"$in": list(site_identifiers)}}, {"next_run": 1, "lease_owner": 1, "lease_expires": 1}):
+            due = job["next_run"]
+            if job["lease_owner"] != None:
+                due = max(due, job["lease_expires"])
+            if next_due == None or due < next_due:
+                next_due = due
+        return next_due
+
+    def close(self):
+        self.stopped.set()
+        with self.lock:
+            leases = list(self.leases.items())
+            self.leases = {}
+
+        # give unfinished jobs back straight away instead of waiting for the lease to expire
+        for site_identifier, lease_token in leases:
+            self.collection.update_one({"_id": site_identifier, "lease_token": lease_token},
+                {"$set": {"lease_owner": None, "lease_expires": 0, "lease_token": None}})
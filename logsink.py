@@ -0,0 +1,96 @@
+import os
+import queue
+import threading
+import traceback
+
+class LogSink:
+    def __init__(self, collection, batch_size=100, flush_interval=1, max_queue_size=10000, block=False):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.block = block
+        self.dropped = 0
+        self.closed = False
+        self.pid = None
+        self.start()
+
+    def start(self):
+        self.pid = os.getpid()
+        self.closed = False
+        self.queue = queue.Queue(maxsize=self.max_queue_size)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, log_line):
+        # threads do not survive a fork, so the child needs its own shipper
+        if self.pid != os.getpid():
+            self.start()
+
+        # lines logged after close (run records, profiles) are written straight through
+        if self.closed:
+            try:
+                self.collection.insert_one(log_line)
+                return True
+            except Exception:
+                print("Failed to ship log line")
+                print(traceback.format_exc())
+                return False
+
+        try:
+            self.queue.put(log_line, block=self.block)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def run(self):
+        while True:
+            try:
+                log_line = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            if log_line == None:
+                self.queue.task_done()
+                return
+
+            log_lines = [log_line]
+            stopping = False
+            while len(log_lines) < self.batch_size:
+                try:
+                    log_line = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if log_line == None:
+                    stopping = True
+                    break
+                log_lines.append(log_line)
+
+            try:
+                self.collection.insert_many(log_lines, ordered=False)
+            except Exception:
+                print("Failed to ship %d log lines" % len(log_lines))
+                print(traceback.format_exc())
+
+            for _ in range(len(log_lines) + (1 if stopping else 0)):
+                self.queue.task_done()
+
+            if stopping:
+                return
+
+    def flush(self):
+        if self.pid != os.getpid() or not self.thread.is_alive():
+            return
+        self.queue.join()
+        if self.dropped > 0:
+            print("Dropped %d log lines (queue full)" % self.dropped)
+            self.dropped = 0
+
+    def close(self):
+        if self.pid != os.getpid() or not self.thread.is_alive():
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.flush()
+        self.thread.join()
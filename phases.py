@@ -0,0 +1,61 @@
+import time
+import functools
+
+from contextlib import contextmanager
+
+class PhaseTimer:
+    def __init__(self):
+        self.phases = {}
+        self.open_phases = set()
+        self.round_trips = 0
+
+    @contextmanager
+    def phase(self, name):
+        # nested phases are inclusive, an outer phase also counts the time and round trips of its inner ones,
+        # but a phase that is already open (recursion, a flush inside a flush) is only timed by its outermost call
+        if name in self.open_phases:
+            yield
+            return
+        self.open_phases.add(name)
+        started = time.perf_counter()
+        round_trips = self.round_trips
+        try:
+            yield
+        finally:
+            self.open_phases.discard(name)
+            entry = self.phases.setdefault(name, {"duration": 0, "count": 0, "round_trips": 0})
+            entry["duration"] += time.perf_counter() - started
+            entry["count"] += 1
+            entry["round_trips"] += self.round_trips - round_trips
+
+    def timed(self, name=None):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.phase(name or func.__name__):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count_round_trips(self, driver):
+        # every WebDriver command goes through execute(), wrap it once and point it at the current timer
+        if not hasattr(driver, "phase_timer"):
+            execute = driver.execute
+            def counting_execute(*args, **kwargs):
+                driver.phase_timer.round_trips += 1
+                return execute(*args, **kwargs)
+            driver.execute = counting_execute
+        driver.phase_timer = self
+
+    def summary(self):
+        return dict((name, {"duration": round(entry["duration"], 3), "count": entry["count"], "round_trips": entry["round_trips"]}) for name, entry in self.phases.items())
+
+def timed_method(name):
+    # for methods of objects that keep their PhaseTimer in self.phases
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.phases.phase(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import cProfile
+import threading
+
+from buildutil import get_build_folder
+
+def get_run_directory(site_identifier, run_identifier):
+    run_directory = os.path.join(get_build_folder("runs"), site_identifier, str(run_identifier))
+    os.makedirs(run_directory, exist_ok=True)
+    return run_directory
+
+def frame_label(frame):
+    code = frame.f_code
+    return "%s:%s" % (os.path.basename(code.co_filename), code.co_name)
+
+class RunProfiler:
+    # cProfile sees every call on the scraper thread, the sampler also sees the image sink and log threads
+    def __init__(self, sample_interval=0.005):
+        self.sample_interval = sample_interval
+        self.profile = cProfile.Profile()
+        self.profiling = False
+        self.stacks = {}
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.sampler = None
+        self.started = None
+        self.duration = 0
+
+    def sample(self):
+        thread_names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+        sampler_ident = threading.get_ident()
+        for thread_ident, frame in sys._current_frames().items():
+            if thread_ident == sampler_ident:
+                continue
+            stack = []
+            while frame != None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            stack.append(thread_names.get(thread_ident, str(thread_ident)))
+            key = ";".join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def run_sampler(self):
+        while not self.stopped.wait(self.sample_interval):
+            self.sample()
+
+    def start(self):
+        self.started = time.time()
+        try:
+            self.profile.enable()
+            self.profiling = True
+        except ValueError:
+            # another profiler is already active in this process (threading mode), sampling still works
+            self.profiling = False
+
+        self.sampler = threading.Thread(target=self.run_sampler, daemon=True)
+        self.sampler.start()
+
+    def stop(self):
+        if self.profiling:
+            self.profile.disable()
+            self.profiling = False
+        self.stopped.set()
+        if self.sampler != None:
+            self.sampler.join()
+            self.sampler = None
+        self.duration = time.time() - self.started
+
+    def save(self, run_directory):
+        paths = []
+        if self.profile.getstats():
+            pstats_path = os.path.join(run_directory, "profile.pstats")
+            self.profile.dump_stats(pstats_path)
+            paths.append(pstats_path)
+
+        # one "frame;frame;frame count" line per distinct stack, the input format of flamegraph.pl and speedscope
+        collapsed_path = os.path.join(run_directory, "stacks.collapsed")
+        with open(collapsed_path, "w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write("%s %d\n" % (stack, count))
+        paths.append(collapsed_path)
+        return paths
@@ -0,0 +1,70 @@
+import json
+import time
+
+from selenium.common.exceptions import TimeoutException
+
+class NetworkIdleTracker:
+    # follows the main frame through chromedriver's performance log, which holds the CDP Network and Page events
+    def __init__(self):
+        self.available = True
+        self.reset()
+
+    def reset(self):
+        self.inflight = set()
+        self.dom_content_loaded = False
+        self.loaded = False
+        self.last_activity = time.time()
+
+    def consume(self, entries):
+        for entry in entries:
+            message = json.loads(entry["message"])["message"]
+            method = message["method"]
+            params = message.get("params", {})
+
+            if method == "Page.frameNavigated" and params.get("frame", {}).get("parentId") == None:
+                # a new document in the main frame, whatever the previous page left in flight no longer matters
+                self.reset()
+            elif method == "Network.requestWillBeSent":
+                self.inflight.add(params["requestId"])
+                self.last_activity = time.time()
+            elif method == "Network.loadingFinished" or method == "Network.loadingFailed":
+                self.inflight.discard(params["requestId"])
+                self.last_activity = time.time()
+            elif method == "Page.domContentEventFired":
+                self.dom_content_loaded = True
+            elif method == "Page.loadEventFired":
+                self.loaded = True
+
+    def poll(self, driver):
+        if not self.available:
+            return False
+        try:
+            self.consume(driver.get_log("performance"))
+            return True
+        except Exception:
+            # the browser was started without performance logging
+            self.available = False
+            return False
+
+def wait_until_ready(driver, tracker, locator=None, timeout=30, idle_time=0.5, max_inflight=2, poll_interval=0.1):
+    # ready once the locator matches, the DOM has loaded and at most max_inflight requests stayed open for idle_time
+    started = time.time()
+    found = locator == None
+    while True:
+        network = tracker.poll(driver)
+        if not found:
+            found = len(driver.find_elements(*locator)) > 0
+
+        if found:
+            if not network:
+                if driver.execute_script("return document.readyState") != "loading":
+                    return "document ready", time.time() - started
+            elif (tracker.dom_content_loaded or tracker.loaded) and len(tracker.inflight) <= max_inflight and time.time() - tracker.last_activity >= idle_time:
+                return "network idle", time.time() - started
+
+        if time.time() - started > timeout:
+            if found:
+                return "timeout with %d requests in flight" % len(tracker.inflight), time.time() - started
+            raise TimeoutException("Page was not ready after %ds, %s never appeared" % (timeout, str(locator)))
+
+        time.sleep(poll_interval)
@@ -0,0 +1,81 @@
+import threading
+
+import psutil
+
+def browser_pids(driver):
+    pids = []
+    if driver.browser_pid != None:
+        pids.append(driver.browser_pid)
+    if driver.service != None and driver.service.process != None:
+        pids.append(driver.service.process.pid)
+    return pids
+
+def process_tree_rss(pids):
+    rss = 0
+    for pid in pids:
+        try:
+            process = psutil.Process(pid)
+            for member in [process] + process.children(recursive=True):
+                rss += member.memory_info().rss
+        except psutil.Error:
+            pass
+    return rss
+
+def get_descendants(pid):
+    try:
+        return psutil.Process(pid).children(recursive=True)
+    except psutil.Error:
+        return []
+
+def kill_processes(processes, timeout=5):
+    # psutil checks the creation time, so a pid reused since the snapshot is left alone
+    killed = []
+    for process in processes:
+        try:
+            process.kill()
+            killed.append(process)
+        except psutil.Error:
+            pass
+    psutil.wait_procs(killed, timeout=timeout)
+    return len(killed)
+
+def kill_descendants(pid, timeout=5):
+    # Chrome, chromedriver and Xvfb outlive a killed run unless they are taken down first
+    return kill_processes(get_descendants(pid), timeout=timeout)
+
+class PeakRssSampler:
+    def __init__(self, pids_func, interval=1):
+        self.pids_func = pids_func
+        self.interval = interval
+        self.peak_rss = 0
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        rss = process_tree_rss(self.pids_func())
+        self.peak_rss = max(self.peak_rss, rss)
+        self.samples += 1
+
+    def run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception:
+                pass
+            if self.stopped.wait(self.interval):
+                break
+
+    def start(self):
+        if self.thread != None:
+            return
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread == None:
+            return self.peak_rss
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+        return self.peak_rss
@@ -5,19 +5,30 @@ import json
 import time
 import sys
 import argparse
-import importlib.util
-import sys
+import traceback
+import heapq
+import hashlib
+import multiprocessing.connection
 
 from operator import itemgetter
 
-from threading import Thread
+from threading import Thread, Event
 from multiprocessing import Process
+from concurrent.futures import Future
 
 from enum import Enum
 
 from pymongo import MongoClient # sync mongodb
-
-from helper import Helper
+from bson.objectid import ObjectId
+
+from logsink import LogSink
+from browserpool import BrowserPool
+from workers import WorkerPool
+from siteloader import declares_class, load_site_class
+from admission import AdmissionController
+from jobqueue import JobQueue
+from profiling import RunProfiler
+from runmetrics import kill_descendants, browser_pids
 from buildutil import get_config_path, get_build_root
 
 verbose = False
@@ -87,17 +98,69 @@ class ScraperManager:
         self.random_user_data_directory = random_user_data_directory
         self.sync_mongodb_client = None
         self.sync_mongodb_database = None
+        self.log_sink = None
         self.concurrency_mode = ConcurrencyMode.SINGLE
         self.scrapers = None
+        self.browser_pool = None
+        self.browser_pool_arguments = None
+        self.worker_pool = None
+        self.completion_event = Event()
 
     def set_concurrency_mode(self, concurrency_mode):
         self.concurrency_mode = concurrency_mode
 
+    def enable_browser_pool(self, max_runs=20, max_rss=1536 * 1024 * 1024, max_idle=4, idle_ttl=900):
+        browser_pool_arguments = {"max_runs": max_runs, "max_rss": max_rss, "max_idle": max_idle, "idle_ttl": idle_ttl}
+        if self.concurrency_mode == ConcurrencyMode.MULTIPROCESSING:
+            # each worker process owns its pool, see start_worker_pool
+            self.browser_pool_arguments = browser_pool_arguments
+            self.log("Browser pool enabled per worker (recycle after %d runs or %d MB RSS, keep at most %d idle for %ds)" % (max_runs, max_rss / (1024 * 1024), max_idle, idle_ttl))
+            return None
+
+        self.browser_pool = BrowserPool(log_func=self.log, **browser_pool_arguments)
+        self.log("Browser pool enabled (recycle after %d runs or %d MB RSS, keep at most %d idle for %ds)" % (max_runs, max_rss / (1024 * 1024), max_idle, idle_ttl))
+        return self.browser_pool
+
+    def enable_profiling(self):
+        # the same flag a site can set in config.json, it travels to worker processes with the site configuration
+        for site_configuration in self.configuration["sites"].values():
+            site_configuration["profile"] = True
+        self.log("Profiling every scraper run")
+
+    def get_helper_arguments(self):
+        return {
+            "sigkill_child_processes": self.sigkill_child_processes,
+            "disable_xvfb": self.disable_xvfb,
+            "start_detached": self.start_detached,
+            "cleanup_user_data_directory": self.cleanup_user_data_directory,
+            "random_user_data_directory": self.random_user_data_directory
+        }
+
+    def start_worker_pool(self, size):
+        if self.concurrency_mode != ConcurrencyMode.MULTIPROCESSING:
+            return None
+
+        browser_pool_arguments = self.browser_pool_arguments
+        if browser_pool_arguments != None:
+            # max_idle is for the whole host, every worker keeps its own pool
+            browser_pool_arguments = dict(browser_pool_arguments, max_idle=max(1, browser_pool_arguments["max_idle"] // size))
+            self.log("Each worker keeps at most %d idle browsers" % browser_pool_arguments["max_idle"])
+
+        self.worker_pool = WorkerPool(size,
+            self.configuration,
+            self.get_helper_arguments(),
+            browser_pool_arguments=browser_pool_arguments,
+            log_func=self.log,
+            completion_callback=self.completion_event.set)
+        self.log("Started %d worker processes" % size)
+        return self.worker_pool
+
     def connect_to_database(self):
         print("Attempting to connect to MongoDB synchronously")
         try:
             self.sync_mongodb_client = MongoClient(self.configuration["database_url"])
             self.sync_mongodb_database = self.sync_mongodb_client[self.configuration["database_name"]]
+            self.log_sink = LogSink(self.sync_mongodb_database["log"])
         except Exception as e:
             raise DatabaseConnectionFailedException(e)
 
@@ -106,27 +169,30 @@ class ScraperManager:
         return info["version"]
 
     def shutdown(self):
+        if self.worker_pool != None:
+            self.log("Shutting down: stopping worker processes")
+            self.worker_pool.close()
+
+        if self.browser_pool != None:
+            self.log("Shutting down: closing pooled browsers")
+            self.browser_pool.close()
+
         self.log("Shutting down: closing database connection")
+        self.log_sink.close()
         self.sync_mongodb_client.close()
 
-    def log(self, line):
-        log_line = {"date": datetime.datetime.utcnow(), "source": "scrapers", "text": line}
-        log_line["_id"] = self.sync_mongodb_database["log"].insert_one(log_line).inserted_id
+    def log(self, line, exception=None):
+        log_line = {"_id": ObjectId(), "date": datetime.datetime.utcnow(), "source": "scrapers", "text": line}
+        if exception != None:
+            log_line["exception"] = exception
+        self.log_sink.put(log_line)
         
         if self.verbose:
             print("[%s] [%s] %s" % (log_line["source"], log_line["date"], line))
+            if exception != None:
+                print(exception)
 
     def load_sites_from_configuration(self):
-        def _import_site(path):
-            if not os.path.exists(path):
-                raise ScriptNotFoundException("The script referenced existing at '%s' was not found." % (path))
-            name = os.path.basename(os.path.splitext(path)[0])
-            spec = importlib.util.spec_from_file_location(name, path)
-            site = importlib.util.module_from_spec(spec)
-            sys.modules[name] = site
-            spec.loader.exec_module(site)
-            return site
-
         scrapers = {}
 
         for site_identifier, site_configuration in self.configuration["sites"].items():
@@ -134,6 +200,10 @@ class ScraperManager:
                 if not site_configuration_property in site_configuration:
                     raise ConfigurationException("Configuration for site '%s' does not contain the '%s' property" % (site_identifier, site_configuration_property))
             
+            for site_configuration_property in ["interval", "priority", "max_runtime", "min_interval", "max_interval", "target_new_reports"]:
+                if site_configuration_property in site_configuration and not type(site_configuration[site_configuration_property]) in [int, float]:
+                    raise ConfigurationException("Configuration for site '%s' has a non-numeric '%s' property" % (site_identifier, site_configuration_property))
+
             if not ".py" in site_configuration["path"]:
                 site_configuration["path"] = site_configuration["path"] + ".py"
 
@@ -141,25 +211,41 @@ class ScraperManager:
             if not os.path.exists(site_path):
                 raise ScriptFileNotFoundException("Site '%s' cannot be found at %s" % (site_identifier, site_path))
 
-            self.log("Importing '%s' @ '%s'" % (site_identifier, site_path))
-            module = _import_site(site_path)
-
-            module_class = getattr(module, site_configuration["class"])
+            try:
+                class_declared = declares_class(site_path, site_configuration["class"])
+            except SyntaxError as e:
+                raise ConfigurationException("Site '%s' at %s does not parse: %s" % (site_identifier, site_path, str(e)))
+            if not class_declared:
+                raise ConfigurationException("Site '%s' at %s does not declare class '%s'" % (site_identifier, site_path, site_configuration["class"]))
 
             scrapers[site_identifier] = {
                 "identifier": site_identifier,
                 "running": False,
                 "last_run": 0,
                 "enabled": site_configuration["enabled"],
-                "class": module_class,
+                "path": site_path,
                 "configuration": site_configuration,
-                "runs": 0
+                "runs": 0,
+                "started": 0,
+                "outcome": None,
+                "helper": None
             }
 
         self.scrapers = scrapers
 
         return self.scrapers.keys()
 
+    def load_scraper_state(self):
+        if self.scrapers == None:
+            raise ConfigurationNotLoadedException("You must call `ScraperManager.load_sites_from_configuration` before attempting to load the scraper state.")
+
+        for state in self.sync_mongodb_database["schedule"].find({"_id": {"$in": list(self.scrapers.keys())}, "last_run": {"$exists": True}}):
+            scraper = self.scrapers[state["_id"]]
+            scraper["last_run"] = state["last_run"]
+            scraper["runs"] = state.get("runs", 0)
+            scraper["outcome"] = state.get("last_outcome")
+            self.log("Loaded state for '%s': last ran %ds ago (%s), %d runs" % (state["_id"], time.time() - scraper["last_run"], scraper["outcome"], scraper["runs"]))
+
     def set_site_override(self, site_override_identifier):
         if self.scrapers == None:
             raise ConfigurationNotLoadedException("You must call `ScraperManager.load_sites_from_configuration` before attempting to set an override.")
@@ -212,7 +298,7 @@ class ScraperManager:
 
         return self.scrapers[site_identifier]["running"]
 
-    def set_site_finished(self, site_identifier):
+    def set_site_finished(self, site_identifier, outcome=None):
         if self.scrapers == None:
             raise ConfigurationNotLoadedException("You must call `ScraperManager.load_sites_from_configuration` before attempting to access the scraper information.")
 
@@ -222,6 +308,16 @@ class ScraperManager:
         self.scrapers[site_identifier]["last_run"] = time.time()
         self.scrapers[site_identifier]["running"] = False
         self.scrapers[site_identifier]["runs"] += 1
+        self.scrapers[site_identifier]["outcome"] = outcome
+
+        # reloaded by load_scraper_state so a restart does not run every site at once
+        try:
+            self.sync_mongodb_database["schedule"].update_one({"_id": site_identifier}, {
+                "$set": {"last_run": self.scrapers[site_identifier]["last_run"], "last_outcome": outcome},
+                "$inc": {"runs": 1}
+            }, upsert=True)
+        except Exception as e:
+            self.log("Failed to save state for '%s': %s" % (site_identifier, str(e)), exception=traceback.format_exc())
         
     def get_scraper_information(self, site_identifier):
         if self.scrapers == None:
@@ -251,27 +347,54 @@ class ScraperManager:
         site_configuration = self.configuration["sites"][site_identifier]
         
         def entrypoint():
+            outcome = "error"
+            site_helper = None
+            profiler = None
+            if site_configuration.get("profile", False):
+                profiler = RunProfiler()
+                profiler.start()
             try:
+                # imported here rather than at startup, so the parent stays small when runs happen in other processes
+                from helper import Helper
+                site_class = load_site_class(self.scrapers[site_identifier]["path"], site_configuration["class"])
                 sync_mongodb_client = MongoClient(self.configuration["database_url"])
                 sync_mongodb_database = sync_mongodb_client[self.configuration["database_name"]]
                 site_helper = Helper(site_identifier,
                     site_configuration["name"],
                     sync_mongodb_database,
-                    sigkill_child_processes=self.sigkill_child_processes,
-                    disable_xvfb=self.disable_xvfb,
-                    start_detached=self.start_detached,
-                    cleanup_user_data_directory=self.cleanup_user_data_directory,
-                    random_user_data_directory=self.random_user_data_directory)
-                site_object = self.scrapers[site_identifier]["class"](site_helper)
+                    options=site_configuration.get("options", {}),
+                    browser_pool=self.browser_pool,
+                    **self.get_helper_arguments())
+                # lets the scheduler measure this run's browser when it shares the scheduler's process
+                self.scrapers[site_identifier]["helper"] = site_helper
+                site_object = site_class(site_helper)
                 site_object.start()
+                outcome = site_helper.get_outcome()
             except Exception as e:
-                self.log("ScraperManager caught an error on site '%s': %s" % (site_identifier, str(e)), exception=e)
+                self.log("ScraperManager caught an error on site '%s': %s" % (site_identifier, str(e)), exception=traceback.format_exc())
             finally:
+                if profiler != None:
+                    profiler.stop()
+                    if site_helper != None:
+                        site_helper.save_profile(profiler)
+                if site_helper != None:
+                    site_helper.sync_record_run(outcome)
                 self.log("ScraperManager site finished: '%s'" % site_identifier)
+                self.log_sink.flush()
+                self.scrapers[site_identifier]["outcome"] = outcome
+                self.scrapers[site_identifier]["helper"] = None
+                self.completion_event.set()
+            return outcome
+
+        def process_entrypoint():
+            # the outcome cannot be shared from a forked process, report it through the exit code
+            if entrypoint() != "success":
+                sys.exit(1)
 
         self.log("Starting scraper '%s'" % site_identifier)
 
         self.scrapers[site_identifier]["running"] = True
+        self.scrapers[site_identifier]["started"] = time.time()
 
         if self.concurrency_mode == ConcurrencyMode.SINGLE:
             entrypoint()
@@ -281,49 +404,241 @@ class ScraperManager:
             thread.start()
             return thread
         elif self.concurrency_mode == ConcurrencyMode.MULTIPROCESSING:
-            process = Process(target=entrypoint)
+            if self.worker_pool != None:
+                return self.worker_pool.submit(site_identifier, site_configuration)
+            process = Process(target=process_entrypoint)
             process.start()
             return process
 
 class ScraperScheduler:
-    def __init__(self, scraper_manager, concurrency_maximum, concurrency_interval):
+    def __init__(self, scraper_manager, concurrency_maximum, concurrency_interval,
+            adaptive_intervals=False,
+            min_interval=300,
+            max_interval=7200,
+            target_new_reports=5,
+            smoothing=0.3,
+            admission_controller=None,
+            admission_retry_interval=15,
+            startup_spread=600):
         self.scraper_manager = scraper_manager
         self.concurrency_maximum = concurrency_maximum
         self.concurrency_interval = concurrency_interval
+        self.adaptive_intervals = adaptive_intervals
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_new_reports = target_new_reports
+        self.smoothing = smoothing
+        self.learned_intervals = {}
         self.tasks = {}
+        self.queue = []
+        self.overrunning = set()
+        self.admission_controller = admission_controller
+        self.admission_retry_interval = admission_retry_interval
+        self.deferred_until = 0
+        self.deferred_reason = None
+        self.startup_spread = startup_spread
+
+        if self.adaptive_intervals:
+            self.load_learned_intervals()
+
+        for site_identifier in self.scraper_manager.get_scraper_identifiers_by_last_run():
+            self.schedule(site_identifier, startup=True)
+
+    def get_site_option(self, site_identifier, name, default):
+        site_information = self.scraper_manager.get_scraper_information(site_identifier)
+        return site_information["configuration"].get(name, default)
+
+    def get_interval(self, site_identifier):
+        if site_identifier in self.learned_intervals:
+            return self.learned_intervals[site_identifier]
+        return self.get_site_option(site_identifier, "interval", self.concurrency_interval)
+
+    def load_learned_intervals(self):
+        for state in self.scraper_manager.sync_mongodb_database["schedule"].find({"interval": {"$exists": True}}):
+            if state["_id"] in self.scraper_manager.get_scraper_identifiers():
+                self.learned_intervals[state["_id"]] = state["interval"]
+                self.scraper_manager.log("Loaded learned interval for '%s': %ds (%s)" % (state["_id"], state["interval"], state.get("reason", "")))
+
+    def adapt_interval(self, site_identifier, previous_run):
+        collection = self.scraper_manager.sync_mongodb_database["schedule"]
+        state = collection.find_one({"_id": site_identifier})
+        # the run died before Helper.stop() recorded anything, keep the previous rate
+        if state == None or not "last_run_identifier" in state or state.get("adapted_run_identifier") == state["last_run_identifier"]:
+            return
+
+        update = {"adapted_run_identifier": state["last_run_identifier"]}
+        if previous_run == 0:
+            collection.update_one({"_id": site_identifier}, {"$set": update})
+            return
+
+        elapsed = max(1, time.time() - previous_run)
+        observed_rate = state["last_run_new"] * 3600 / elapsed
+        if state.get("new_rate") == None:
+            new_rate = observed_rate
+        else:
+            new_rate = self.smoothing * observed_rate + (1 - self.smoothing) * state["new_rate"]
 
-    def run_iteration(self):
+        min_interval = self.get_site_option(site_identifier, "min_interval", self.min_interval)
+        max_interval = self.get_site_option(site_identifier, "max_interval", self.max_interval)
+        target_new_reports = self.get_site_option(site_identifier, "target_new_reports", self.target_new_reports)
+        if new_rate > 0:
+            interval = target_new_reports * 3600 / new_rate
+        else:
+            interval = max_interval
+        interval = min(max_interval, max(min_interval, interval))
+
+        reason = "%.1f new reports/hour (last run %d new, %d seen after %ds), aiming for %d new per run" % (new_rate, state["last_run_new"], state["last_run_seen"], elapsed, target_new_reports)
+        update.update({
+            "new_rate": new_rate,
+            "interval": interval,
+            "reason": reason,
+            "adapted": datetime.datetime.utcnow()
+        })
+        collection.update_one({"_id": site_identifier}, {"$set": update})
+
+        self.learned_intervals[site_identifier] = interval
+        self.scraper_manager.log("Interval for '%s' is now %ds: %s" % (site_identifier, interval, reason))
+
+    def get_priority(self, site_identifier):
+        return self.get_site_option(site_identifier, "priority", 0)
+
+    def get_max_runtime(self, site_identifier):
+        return self.get_site_option(site_identifier, "max_runtime", None)
+
+    def get_next_run(self, site_identifier):
+        site_information = self.scraper_manager.get_scraper_information(site_identifier)
+        if site_information["last_run"] == 0:
+            return 0
+        return site_information["last_run"] + self.get_interval(site_identifier)
+
+    def get_jitter(self, site_identifier):
+        # a fixed fraction per site, so every restart spreads the sites the same way
+        return int(hashlib.sha1(site_identifier.encode("utf-8")).hexdigest()[:8], 16) / 0xffffffff
+
+    def get_startup_run(self, site_identifier):
+        # the spread only protects the host from many overdue sites at once; a single site (-o) is
+        # started on purpose and a site that has never run has no persisted schedule, both start when due
+        if self.scraper_manager.get_num_scrapers_enabled() <= 1 or self.scraper_manager.get_scraper_information(site_identifier)["last_run"] == 0:
+            return self.get_next_run(site_identifier)
+        now = time.time()
+        spread = min(self.startup_spread, self.get_interval(site_identifier))
+        return max(self.get_next_run(site_identifier), now + self.get_jitter(site_identifier) * spread)
+
+    def schedule(self, site_identifier, startup=False):
+        if not self.scraper_manager.is_scraper_enabled(site_identifier):
+            return
+        if startup:
+            next_run = self.get_startup_run(site_identifier)
+        else:
+            next_run = self.get_next_run(site_identifier)
+        heapq.heappush(self.queue, (next_run, site_identifier))
 
+    def run_iteration(self):
         scrapers_running = self.scraper_manager.get_num_scrapers_running()
-        if scrapers_running < self.concurrency_maximum:
-            scrapers_starting = self.concurrency_maximum - scrapers_running
-            
-            for site_identifier in self.scraper_manager.get_scraper_identifiers_by_last_run():
-                site_information = self.scraper_manager.get_scraper_information(site_identifier)
-
-                def scraper_runnable():
-                    if not site_information["enabled"]:
-                        return False
-                    if site_information["running"]:
-                        return False
-                    if site_information["last_run"] == 0:
-                        return True
-                    if ((time.time() - site_information["last_run"]) > self.concurrency_interval):
-                        return True
-                    else:
-                        return False
-
-                if scraper_runnable():
-                    self.tasks[site_identifier] = self.scraper_manager.start_scraper(site_identifier)
-                    scrapers_starting -= 1
-                    if scrapers_starting == 0:
-                        break
-            
-            return self.concurrency_maximum - scrapers_running != scrapers_starting
-        else:
+        scrapers_started = 0
+        now = time.time()
+
+        if scrapers_running >= self.concurrency_maximum or now < self.deferred_until:
             return False
 
+        eligible = []
+        while len(self.queue) > 0 and self.queue[0][0] <= now:
+            eligible.append(heapq.heappop(self.queue))
+
+        # among the sites that are due, the highest priority goes first, then the most overdue
+        eligible.sort(key=lambda entry: (-self.get_priority(entry[1]), entry[0]))
+
+        for next_run, site_identifier in eligible:
+            site_information = self.scraper_manager.get_scraper_information(site_identifier)
+            # finished scrapers are queued again by find_dead_tasks
+            if not site_information["enabled"] or site_information["running"]:
+                continue
+
+            if scrapers_running + scrapers_started >= self.concurrency_maximum or now < self.deferred_until:
+                heapq.heappush(self.queue, (next_run, site_identifier))
+                continue
+
+            if not self.admit(site_identifier, scrapers_running + scrapers_started):
+                heapq.heappush(self.queue, (next_run, site_identifier))
+                continue
+
+            self.tasks[site_identifier] = self.scraper_manager.start_scraper(site_identifier)
+            scrapers_started += 1
+
+        return scrapers_started > 0
+
+    def admit(self, site_identifier, scrapers_running):
+        if self.admission_controller == None:
+            return True
+
+        try:
+            reason = self.admission_controller.check(scrapers_running, self.get_task_pids())
+        except Exception as e:
+            self.scraper_manager.log("Admission check failed, starting anyway: %s" % str(e), exception=traceback.format_exc())
+            return True
+
+        if reason == None:
+            if self.deferred_reason != None:
+                self.scraper_manager.log("Host has capacity again, resuming scraper starts")
+                self.deferred_reason = None
+            return True
+
+        self.deferred_until = time.time() + self.admission_retry_interval
+        # only log when the kind of shortage changes, the check repeats every few seconds while saturated
+        reason_kind, reason_message = reason
+        if reason_kind != self.deferred_reason:
+            self.scraper_manager.log("Deferring '%s' with %d scrapers running: %s" % (site_identifier, scrapers_running, reason_message))
+            self.deferred_reason = reason_kind
+        return False
+
+    def get_task_pids(self):
+        task_pids = []
+        for site_identifier, site_task_instance in list(self.tasks.items()):
+            if type(site_task_instance) == Process:
+                task_pids.append([site_task_instance.pid])
+            elif type(site_task_instance) == Future:
+                pid = self.scraper_manager.worker_pool.get_pid(site_task_instance)
+                if pid != None:
+                    task_pids.append([pid])
+            else:
+                site_helper = self.scraper_manager.get_scraper_information(site_identifier).get("helper", None)
+                if site_helper != None and site_helper.driver != None:
+                    task_pids.append(browser_pids(site_helper.driver))
+        return task_pids
+
+    def get_runtime_deadline(self, site_identifier):
+        max_runtime = self.get_max_runtime(site_identifier)
+        if max_runtime == None:
+            return None
+        return self.scraper_manager.get_scraper_information(site_identifier)["started"] + max_runtime
+
+    def stop_overrunning_tasks(self):
+        now = time.time()
+        for site_identifier, site_task_instance in list(self.tasks.items()):
+            deadline = self.get_runtime_deadline(site_identifier)
+            if deadline == None or deadline > now or site_identifier in self.overrunning:
+                continue
+
+            self.overrunning.add(site_identifier)
+            if type(site_task_instance) == Process:
+                self.scraper_manager.log("Scraper '%s' exceeded its max_runtime of %ds, terminating" % (site_identifier, self.get_max_runtime(site_identifier)))
+                # terminating skips Helper.stop(), so the browser processes have to go first
+                killed = kill_descendants(site_task_instance.pid)
+                if killed > 0:
+                    self.scraper_manager.log("Killed %d child processes of scraper '%s'" % (killed, site_identifier))
+                site_task_instance.terminate()
+                site_task_instance.join(5)
+                if site_task_instance.is_alive():
+                    site_task_instance.kill()
+            elif type(site_task_instance) == Future:
+                self.scraper_manager.log("Scraper '%s' exceeded its max_runtime of %ds, replacing its worker" % (site_identifier, self.get_max_runtime(site_identifier)))
+                self.scraper_manager.worker_pool.terminate(site_task_instance)
+            else:
+                self.scraper_manager.log("Scraper '%s' exceeded its max_runtime of %ds but cannot be terminated in this concurrency mode" % (site_identifier, self.get_max_runtime(site_identifier)))
+
     def find_dead_tasks(self):
+        # cleared before the scan, a task that sets it while still alive wakes the next wait() instead of being lost
+        self.scraper_manager.completion_event.clear()
         dead_tasks = []
         for site_identifier in list(self.tasks.keys()):
             site_task_instance = self.tasks[site_identifier]
@@ -331,15 +646,128 @@ class ScraperScheduler:
             if type(site_task_instance) == Thread or type(site_task_instance) == Process:
                 if not site_task_instance.is_alive():
                     dead_tasks.append(site_identifier)
-                    self.scraper_manager.set_site_finished(site_identifier)
-                    del self.tasks[site_identifier]
-            else:
-                if site_task_instance:
+            elif type(site_task_instance) == Future:
+                if site_task_instance.done():
                     dead_tasks.append(site_identifier)
-                    self.scraper_manager.set_site_finished(site_identifier)
-                    del self.tasks[site_identifier]
+            elif site_task_instance:
+                dead_tasks.append(site_identifier)
+
+        for site_identifier in dead_tasks:
+            previous_run = self.scraper_manager.get_scraper_information(site_identifier)["last_run"]
+            self.scraper_manager.set_site_finished(site_identifier, self.get_task_outcome(site_identifier, self.tasks[site_identifier]))
+            if self.adaptive_intervals:
+                try:
+                    self.adapt_interval(site_identifier, previous_run)
+                except Exception as e:
+                    self.scraper_manager.log("Failed to adapt interval for '%s': %s" % (site_identifier, str(e)), exception=traceback.format_exc())
+            del self.tasks[site_identifier]
+            self.overrunning.discard(site_identifier)
+            self.schedule(site_identifier)
+
         return dead_tasks
 
+    def get_task_outcome(self, site_identifier, site_task_instance):
+        if site_identifier in self.overrunning:
+            return "terminated"
+        if type(site_task_instance) == Process:
+            return "success" if site_task_instance.exitcode == 0 else "error"
+        if type(site_task_instance) == Future:
+            return site_task_instance.result()
+        return self.scraper_manager.get_scraper_information(site_identifier)["outcome"]
+
+    def get_wait_timeout(self):
+        deadlines = []
+        if len(self.tasks) < self.concurrency_maximum and len(self.queue) > 0:
+            deadlines.append(max(self.queue[0][0], self.deferred_until))
+
+        for site_identifier in self.tasks.keys():
+            deadline = self.get_runtime_deadline(site_identifier)
+            if deadline != None and not site_identifier in self.overrunning:
+                deadlines.append(deadline)
+
+        if len(deadlines) == 0:
+            return None
+        return max(0, min(deadlines) - time.time())
+
+    def wait(self):
+        # sleep until the next scraper becomes eligible or a running one finishes, whichever is first
+        timeout = self.get_wait_timeout()
+        processes = [task for task in self.tasks.values() if type(task) == Process]
+        threads = [task for task in self.tasks.values() if type(task) == Thread or type(task) == Future]
+
+        if len(processes) > 0:
+            multiprocessing.connection.wait([process.sentinel for process in processes], timeout)
+        elif len(threads) > 0:
+            self.scraper_manager.completion_event.wait(timeout)
+        elif timeout != None:
+            time.sleep(timeout)
+        elif len(self.tasks) == 0:
+            time.sleep(self.concurrency_interval)
+
+    def close(self):
+        pass
+
+class DistributedScraperScheduler(ScraperScheduler):
+    def __init__(self, scraper_manager, concurrency_maximum, concurrency_interval, job_queue, poll_interval=10, **kwargs):
+        self.job_queue = job_queue
+        self.poll_interval = poll_interval
+        ScraperScheduler.__init__(self, scraper_manager, concurrency_maximum, concurrency_interval, **kwargs)
+
+        for site_identifier in self.scraper_manager.get_scraper_identifiers():
+            self.job_queue.register(site_identifier,
+                self.get_interval(site_identifier),
+                self.get_priority(site_identifier),
+                next_run=self.get_startup_run(site_identifier))
+        self.job_queue.start_heartbeat()
+        self.scraper_manager.log("Distributed scheduling as node '%s'" % self.job_queue.node_identifier)
+
+    def get_enabled_identifiers(self):
+        return [site_identifier for site_identifier in self.scraper_manager.get_scraper_identifiers() if self.scraper_manager.is_scraper_enabled(site_identifier)]
+
+    def schedule(self, site_identifier, startup=False):
+        # the jobs collection is the schedule, finishing a run releases its lease with the next due time
+        if startup:
+            return
+        self.job_queue.complete(site_identifier, time.time() + self.get_interval(site_identifier))
+
+    def run_iteration(self):
+        scrapers_running = self.scraper_manager.get_num_scrapers_running()
+        scrapers_started = 0
+
+        while scrapers_running + scrapers_started < self.concurrency_maximum and time.time() >= self.deferred_until:
+            if not self.admit("the next job", scrapers_running + scrapers_started):
+                break
+
+            job = self.job_queue.acquire(self.get_enabled_identifiers())
+            if job == None:
+                break
+
+            site_identifier = job["_id"]
+            # last_run comes from whichever node ran the site last, adaptive intervals need it
+            self.scraper_manager.get_scraper_information(site_identifier)["last_run"] = job["last_run"]
+            self.tasks[site_identifier] = self.scraper_manager.start_scraper(site_identifier)
+            scrapers_started += 1
+
+        return scrapers_started > 0
+
+    def get_wait_timeout(self):
+        # other nodes change the schedule too, so never sleep longer than the poll interval
+        deadlines = [time.time() + self.poll_interval]
+        if len(self.tasks) < self.concurrency_maximum:
+            next_due = self.job_queue.get_next_due(self.get_enabled_identifiers())
+            if next_due != None:
+                deadlines.append(max(next_due, self.deferred_until))
+
+        for site_identifier in self.tasks.keys():
+            deadline = self.get_runtime_deadline(site_identifier)
+            if deadline != None and not site_identifier in self.overrunning:
+                deadlines.append(deadline)
+
+        return max(0, min(deadlines) - time.time())
+
+    def close(self):
+        self.job_queue.close()
+
 def parse_args():
     parser = argparse.ArgumentParser(
                     prog = "newswall Scrapers",
@@ -356,6 +784,23 @@ def parse_args():
     parser.add_argument("-c", "--cleanup-user-data-directory", dest="cleanup_user_data_directory", action="store_true", default=False, help="Remove the whole user data directory every time it scrapes (including each scrape in the same program execution)")
     parser.add_argument("-o", "--override-site", dest="override_site", action="store", type=str, default="", help="Override the configuration and only start the specified site")
     parser.add_argument("-x", "--disable-xvfb", dest="disable_xvfb", action="store_true", default=False, help="Disable headless Xvfb and use DISPLAY from script environment")
+    parser.add_argument("-a", "--adaptive-intervals", dest="adaptive_intervals", action="store_true", default=False, help="Learn each site's interval from how many new reports its runs produce")
+    parser.add_argument("--min-interval", dest="min_interval", action="store", type=int, default=300, help="Shortest interval adaptive scheduling may choose (per-site min_interval overrides)")
+    parser.add_argument("--max-interval", dest="max_interval", action="store", type=int, default=7200, help="Longest interval adaptive scheduling may choose (per-site max_interval overrides)")
+    parser.add_argument("-p", "--browser-pool", dest="browser_pool", action="store_true", default=False, help="Keep each site's browser and Xvfb running between runs and reuse it (in multiprocessing mode each worker process keeps its own pool, not available with --fresh-processes)")
+    parser.add_argument("--browser-pool-max-runs", dest="browser_pool_max_runs", action="store", type=int, default=20, help="Recycle a pooled browser after this many runs")
+    parser.add_argument("--browser-pool-max-rss", dest="browser_pool_max_rss", action="store", type=int, default=1536, help="Recycle a pooled browser once its process tree uses more than this many MB")
+    parser.add_argument("--browser-pool-max-idle", dest="browser_pool_max_idle", action="store", type=int, default=4, help="Keep at most this many idle browsers, closing the least recently used first (in multiprocessing mode divided among the workers, at least 1 each)")
+    parser.add_argument("--browser-pool-idle-ttl", dest="browser_pool_idle_ttl", action="store", type=int, default=900, help="Close a pooled browser after it has been idle for this many seconds")
+    parser.add_argument("-w", "--fresh-processes", dest="fresh_processes", action="store_true", default=False, help="(Multiprocessing) Start a fresh process for every run instead of reusing warm worker processes")
+    parser.add_argument("--min-available-memory", dest="min_available_memory", action="store", type=int, default=1024, help="Defer starting a scraper unless this many MB would remain available after it starts (0 disables)")
+    parser.add_argument("--max-load", dest="max_load", action="store", type=float, default=1.5, help="Defer starting a scraper while the 1 minute load average per CPU is above this (0 disables)")
+    parser.add_argument("--scraper-rss-estimate", dest="scraper_rss_estimate", action="store", type=int, default=600, help="Minimum MB a new scraper is expected to use, the observed average of running scrapers is used when higher")
+    parser.add_argument("--startup-spread", dest="startup_spread", action="store", type=int, default=600, help="Spread the first runs of overdue sites over this many seconds after startup (capped at each site's interval)")
+    parser.add_argument("-P", "--profile", dest="profile", action="store_true", default=False, help="Profile every run and save profile.pstats and stacks.collapsed under runs/<site>/<run> (set \"profile\": true on a site to profile only that site)")
+    parser.add_argument("-D", "--distributed", dest="distributed", action="store_true", default=False, help="Share the schedule with other nodes through the jobs collection, any number of nodes may run against the same database")
+    parser.add_argument("--node-id", dest="node_identifier", action="store", type=str, default=None, help="(Distributed) Name of this node in job leases (default hostname-pid)")
+    parser.add_argument("--lease-duration", dest="lease_duration", action="store", type=int, default=120, help="(Distributed) Seconds a job lease lasts without a heartbeat before other nodes may reclaim it")
     parser.add_argument("-v", "--verbose", dest="verbose", action="store_true", default=True)
 
     return parser, parser.parse_args()
@@ -368,6 +813,10 @@ def main():
     except:
         raise InvalidProgramArgumentException("Concurrency mode '%s' was not found")
 
+    if args.browser_pool and args.fresh_processes and concurrency_mode == ConcurrencyMode.MULTIPROCESSING:
+        # a fresh process would take its pool down with it after every run
+        raise InvalidProgramArgumentException("The browser pool needs warm worker processes and cannot be used with --fresh-processes")
+
     manager = ScraperManager(args.configuration_path,
         disable_xvfb=args.disable_xvfb,
         sigkill_child_processes=args.sigkill_child_processes,
@@ -390,6 +839,20 @@ def main():
         print(configuration_exception.message)
         sys.exit(2)
 
+    manager.load_scraper_state()
+
+    if args.profile:
+        manager.enable_profiling()
+
+    if args.browser_pool:
+        manager.enable_browser_pool(max_runs=args.browser_pool_max_runs,
+            max_rss=args.browser_pool_max_rss * 1024 * 1024,
+            max_idle=args.browser_pool_max_idle,
+            idle_ttl=args.browser_pool_idle_ttl)
+
+    if not args.fresh_processes:
+        manager.start_worker_pool(args.concurrency_maximum)
+
     if args.override_site != "":
         manager.set_site_override(args.override_site)
 
@@ -397,23 +860,45 @@ def main():
         print("No scrapers are enabled")
         sys.exit(3)
 
-    scheduler = ScraperScheduler(manager,
-        concurrency_maximum=args.concurrency_maximum,
-        concurrency_interval=args.concurrency_interval)
+    scheduler_arguments = {
+        "concurrency_maximum": args.concurrency_maximum,
+        "concurrency_interval": args.concurrency_interval,
+        "adaptive_intervals": args.adaptive_intervals,
+        "min_interval": args.min_interval,
+        "max_interval": args.max_interval,
+        "startup_spread": args.startup_spread,
+        "admission_controller": AdmissionController(min_available_memory=args.min_available_memory * 1024 * 1024,
+            max_load=args.max_load,
+            scraper_rss_estimate=args.scraper_rss_estimate * 1024 * 1024)
+    }
+
+    if args.distributed:
+        job_queue = JobQueue(manager.sync_mongodb_database,
+            node_identifier=args.node_identifier,
+            lease_duration=args.lease_duration,
+            heartbeat_interval=max(1, args.lease_duration / 4),
+            log_func=manager.log)
+        scheduler = DistributedScraperScheduler(manager, job_queue=job_queue, **scheduler_arguments)
+    else:
+        scheduler = ScraperScheduler(manager, **scheduler_arguments)
 
     running = True
-    while running:
-        scrapers_started = scheduler.run_iteration()
-        if scrapers_started:
-            manager.log("%d scrapers are running" % (manager.get_num_scrapers_running()))
+    try:
+        while running:
+            scheduler.stop_overrunning_tasks()
 
-        dead_tasks = scheduler.find_dead_tasks()
-        if len(dead_tasks) > 0:
-            manager.log("%d scrapers have ended" % len(dead_tasks))
+            dead_tasks = scheduler.find_dead_tasks()
+            if len(dead_tasks) > 0:
+                manager.log("%d scrapers have ended" % len(dead_tasks))
 
-        time.sleep(0.1)
+            scrapers_started = scheduler.run_iteration()
+            if scrapers_started:
+                manager.log("%d scrapers are running" % (manager.get_num_scrapers_running()))
 
-    manager.shutdown()
+            scheduler.wait()
+    finally:
+        scheduler.close()
+        manager.shutdown()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
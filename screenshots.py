@@ -0,0 +1,251 @@
+import base64
+
+from io import BytesIO
+
+from PIL import Image
+
+# only scroll when the element is not already fully visible, so neighbouring elements share a capture
+ELEMENT_RECT_SCRIPT = """
+var element = arguments[0];
+var rect = element.getBoundingClientRect();
+if (rect.top < 0 || rect.left < 0 || rect.bottom > window.innerHeight || rect.right > window.innerWidth) {
+    element.scrollIntoView(true);
+    rect = element.getBoundingClientRect();
+}
+var width = element.offsetWidth;
+var height = element.offsetHeight;
+if (arguments[1]) {
+    var style = window.getComputedStyle(element);
+    width = parseFloat(style.width);
+    height = parseFloat(style.height);
+}
+return [rect.left, rect.top, width, height, window.scrollX, window.scrollY, window.innerWidth, window.innerHeight];
+"""
+
+# the box around several elements, measured after the one scroll that brings them into view
+ELEMENTS_RECT_SCRIPT = """
+var elements = arguments[0];
+var computedSize = arguments[1];
+function bounds() {
+    var left = Infinity, top = Infinity, right = -Infinity, bottom = -Infinity;
+    for (var i = 0; i < elements.length; i++) {
+        var rect = elements[i].getBoundingClientRect();
+        var width = elements[i].offsetWidth;
+        var height = elements[i].offsetHeight;
+        if (computedSize) {
+            var style = window.getComputedStyle(elements[i]);
+            width = parseFloat(style.width);
+            height = parseFloat(style.height);
+        }
+        left = Math.min(left, rect.left);
+        top = Math.min(top, rect.top);
+        right = Math.max(right, rect.left + width);
+        bottom = Math.max(bottom, rect.top + height);
+    }
+    return [left, top, right, bottom];
+}
+var box = bounds();
+if (box[1] < 0 || box[0] < 0 || box[3] > window.innerHeight || box[2] > window.innerWidth) {
+    elements[0].scrollIntoView(true);
+    box = bounds();
+}
+return [box[0], box[1], box[2] - box[0], box[3] - box[1], window.scrollX, window.scrollY];
+"""
+
+CAPTURE_MODES = ["viewport", "clip", "page"]
+CLIP_FORMATS = ["png", "webp", "jpeg"]
+
+# document coordinates of many elements in one round trip, without scrolling any of them into view
+ELEMENT_DOCUMENT_RECTS_SCRIPT = """
+var computedSize = arguments[1];
+return Array.from(arguments[0], function (element) {
+    var rect = element.getBoundingClientRect();
+    var width = element.offsetWidth;
+    var height = element.offsetHeight;
+    if (computedSize) {
+        var style = window.getComputedStyle(element);
+        width = parseFloat(style.width);
+        height = parseFloat(style.height);
+    }
+    return [rect.left + window.scrollX, rect.top + window.scrollY, width, height];
+});
+"""
+
+PAGE_SIZE_SCRIPT = """
+var body = document.body, html = document.documentElement;
+return [Math.max(body.scrollWidth, html.scrollWidth, html.clientWidth), Math.max(body.scrollHeight, body.offsetHeight, html.clientHeight, html.scrollHeight, html.offsetHeight)];
+"""
+
+class ScreenshotService:
+    def __init__(self, driver, capture_mode="viewport", clip_format="png", clip_quality=90, max_page_height=16384):
+        if not capture_mode in CAPTURE_MODES:
+            raise ValueError("Unknown capture mode '%s'" % capture_mode)
+        if not clip_format in CLIP_FORMATS:
+            raise ValueError("Unknown clip format '%s'" % clip_format)
+        self.driver = driver
+        self.capture_mode = capture_mode
+        self.clip_format = clip_format
+        self.clip_quality = clip_quality
+        self.max_page_height = max_page_height
+        self.page_image = None
+        self.document_rects = {}
+        self.image = None
+        self.image_scroll_position = None
+        self.scroll_position = None
+        self.viewport_size = None
+        self.rects_shifted = False
+        self.captures = 0
+        self.bytes_captured = 0
+
+    @classmethod
+    def from_options(cls, driver, options):
+        capture_options = options.get("capture", {})
+        return cls(driver,
+            capture_mode=capture_options.get("mode", "viewport"),
+            clip_format=capture_options.get("format", "png"),
+            clip_quality=capture_options.get("quality", 90),
+            max_page_height=capture_options.get("max_page_height", 16384))
+
+    def invalidate(self):
+        self.image = None
+        self.image_scroll_position = None
+        self.scroll_position = None
+        self.rects_shifted = False
+        self.page_image = None
+        self.document_rects = {}
+
+    def prefetch_rects(self, elements, computed_size=False):
+        if self.capture_mode != "page" or len(elements) == 0:
+            return
+        rects = self.driver.execute_script(ELEMENT_DOCUMENT_RECTS_SCRIPT, elements, computed_size)
+        for element, rect in zip(elements, rects):
+            self.document_rects[(element.id, computed_size)] = rect
+
+    def document_rect(self, element, computed_size=False):
+        key = (element.id, computed_size)
+        if not key in self.document_rects:
+            self.prefetch_rects([element], computed_size=computed_size)
+        left, top, width, height = self.document_rects[key]
+        return (round(left), round(top), int(width), int(height))
+
+    def element_rect(self, element, computed_size=False):
+        # in page mode everything is in document coordinates and nothing scrolls
+        if self.capture_mode == "page":
+            return self.document_rect(element, computed_size=computed_size)
+        return self.viewport_rect(element, computed_size=computed_size)
+
+    def elements_rect(self, elements, computed_size=False):
+        if self.capture_mode == "page":
+            rects = [self.document_rect(element, computed_size=computed_size) for element in elements]
+            left = min(rect[0] for rect in rects)
+            top = min(rect[1] for rect in rects)
+            right = max(rect[0] + rect[2] for rect in rects)
+            bottom = max(rect[1] + rect[3] for rect in rects)
+            return (left, top, right - left, bottom - top)
+        left, top, width, height, scroll_x, scroll_y = self.driver.execute_script(ELEMENTS_RECT_SCRIPT, elements, computed_size)
+        self.scroll_position = (scroll_x, scroll_y)
+        return (round(left), round(top), int(width), int(height))
+
+    def viewport_rect(self, element, computed_size=False):
+        left, top, width, height, scroll_x, scroll_y, viewport_width, viewport_height = self.driver.execute_script(ELEMENT_RECT_SCRIPT, element, computed_size)
+        self.scroll_position = (scroll_x, scroll_y)
+        self.viewport_size = (viewport_width, viewport_height)
+        return (round(left), round(top), int(width), int(height))
+
+    def viewport(self):
+        if self.image == None or self.image_scroll_position != self.scroll_position:
+            png = self.driver.get_screenshot_as_png()
+            self.image = Image.open(BytesIO(png))
+            self.image.load()
+            self.image_scroll_position = self.scroll_position
+            self.captures += 1
+            self.bytes_captured += len(png)
+        return self.image
+
+    def crop(self, box):
+        return self.viewport().crop(box)
+
+    def clip(self, box, beyond_viewport=False):
+        # the browser encodes only the clipped pixels, clip coordinates are relative to the document
+        left, top, right, bottom = box
+        scroll_x, scroll_y = self.scroll_position or (0, 0)
+        if beyond_viewport:
+            # box is already in document coordinates and may lie outside the viewport
+            scroll_x, scroll_y = 0, 0
+        parameters = {
+            "format": self.clip_format,
+            "clip": {"x": left + scroll_x, "y": top + scroll_y, "width": right - left, "height": bottom - top, "scale": 1},
+            "fromSurface": True
+        }
+        if beyond_viewport:
+            parameters["captureBeyondViewport"] = True
+        if self.clip_format != "png":
+            parameters["quality"] = self.clip_quality
+        data = base64.b64decode(self.driver.execute_cdp_cmd("Page.captureScreenshot", parameters)["data"])
+        image = Image.open(BytesIO(data))
+        image.load()
+        self.captures += 1
+        self.bytes_captured += len(data)
+        return image
+
+    def page(self):
+        # one capture of the whole document, every element in page mode is cropped from it
+        if self.page_image == None:
+            width, height = self.driver.execute_script(PAGE_SIZE_SCRIPT)
+            height = min(height, self.max_page_height)
+            data = base64.b64decode(self.driver.execute_cdp_cmd("Page.captureScreenshot", {
+                "format": "png",
+                "clip": {"x": 0, "y": 0, "width": width, "height": height, "scale": 1},
+                "captureBeyondViewport": True,
+                "fromSurface": True
+            })["data"])
+            self.page_image = Image.open(BytesIO(data))
+            self.page_image.load()
+            self.captures += 1
+            self.bytes_captured += len(data)
+        return self.page_image
+
+    def region(self, box):
+        # box is in the coordinates element_rect returns: document coordinates in page mode, viewport coordinates otherwise
+        if self.capture_mode == "page":
+            page = self.page()
+            if box[3] <= page.height:
+                return page.crop(box)
+            # past the height a single capture can hold, clip it from the document instead
+            return self.clip(box, beyond_viewport=True)
+        if self.capture_mode == "clip":
+            return self.clip(box)
+        return self.crop(box)
+
+    def rect_region(self, element, rect):
+        # rect is in document coordinates as extract() returns it, width and height may cover more than the element
+        left, top, width, height = round(rect[0]), round(rect[1]), int(rect[2]), int(rect[3])
+        if width == 0 or height == 0:
+            return None
+        if self.capture_mode == "page":
+            return self.region((left, top, left + width, top + height))
+
+        if not self.rects_shifted and self.rect_visible(left, top, width, height):
+            scroll_x, scroll_y = self.scroll_position
+            return self.region((left - scroll_x, top - scroll_y, left - scroll_x + width, top - scroll_y + height))
+
+        # scrolling can load images and ads that move everything below them, so measure the element where it is now
+        viewport_left, viewport_top, _, _ = self.viewport_rect(element)
+        scroll_x, scroll_y = self.scroll_position
+        if abs(viewport_left + scroll_x - left) > 1 or abs(viewport_top + scroll_y - top) > 1:
+            # the extracted rects no longer match the page, measure every element until the next extract()
+            self.rects_shifted = True
+        return self.region((viewport_left, viewport_top, viewport_left + width, viewport_top + height))
+
+    def rect_visible(self, left, top, width, height):
+        if self.scroll_position == None or self.viewport_size == None:
+            return False
+        scroll_x, scroll_y = self.scroll_position
+        viewport_width, viewport_height = self.viewport_size
+        return left >= scroll_x and top >= scroll_y and left + width <= scroll_x + viewport_width and top + height <= scroll_y + viewport_height
+
+    def element(self, element, computed_size=False):
+        left, top, width, height = self.element_rect(element, computed_size=computed_size)
+        if width == 0 or height == 0:
+            return None
+        return self.region((left, top, left + width, top + height))
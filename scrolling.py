@@ -0,0 +1,127 @@
+# runs with execute_async_script: scrolls a viewport at a time until the bottom of the document is visible,
+# then waits until nothing has been added, resized or loaded for quietPeriod ms before calling back once.
+# It gives up early when scrolling stops moving the page (inner scroll containers, fixed-height body) and
+# stops waiting for quiet once the bottom has been visible for maxSettle ms (tickers, rotating ads)
+SCROLL_SCRIPT = """
+var quietPeriod = arguments[0];
+var maxDuration = arguments[1];
+var stepInterval = arguments[2];
+var maxStuckSteps = arguments[3];
+var maxSettle = arguments[4];
+var done = arguments[arguments.length - 1];
+
+var started = Date.now();
+var lastChange = started;
+var lastScroll = 0;
+var lastHeight = 0;
+var atBottom = false;
+var atBottomSince = null;
+var steps = 0;
+var stuckSteps = 0;
+var mutations = 0;
+var forcedImages = 0;
+var pendingImages = 0;
+
+function documentHeight() {
+    var body = document.body, html = document.documentElement;
+    return Math.max(body.scrollHeight, body.offsetHeight, html.clientHeight, html.scrollHeight, html.offsetHeight);
+}
+
+function prepareImages(root) {
+    if (root.nodeType !== 1) {
+        return;
+    }
+    var images = root.tagName === "IMG" ? [root] : Array.from(root.querySelectorAll("img"));
+    images.forEach(function (image) {
+        if (image.loading === "lazy") {
+            image.loading = "eager";
+            forcedImages++;
+        }
+        if (!image.complete && !image.newswallPending) {
+            image.newswallPending = true;
+            pendingImages++;
+            var settle = function () {
+                pendingImages--;
+                lastChange = Date.now();
+            };
+            image.addEventListener("load", settle, {once: true});
+            image.addEventListener("error", settle, {once: true});
+        }
+    });
+}
+
+var mutationObserver = new MutationObserver(function (records) {
+    mutations += records.length;
+    lastChange = Date.now();
+    records.forEach(function (record) {
+        record.addedNodes.forEach(prepareImages);
+    });
+});
+mutationObserver.observe(document.body, {childList: true, subtree: true});
+
+var sentinel = document.createElement("div");
+sentinel.style.cssText = "width:1px;height:1px;";
+document.body.appendChild(sentinel);
+var intersectionObserver = new IntersectionObserver(function (entries) {
+    atBottom = entries[entries.length - 1].isIntersecting;
+    atBottomSince = atBottom ? Date.now() : null;
+    lastChange = Date.now();
+});
+intersectionObserver.observe(sentinel);
+
+prepareImages(document.body);
+
+function finish(reason) {
+    mutationObserver.disconnect();
+    intersectionObserver.disconnect();
+    sentinel.remove();
+    done({
+        reason: reason,
+        duration: Date.now() - started,
+        steps: steps,
+        mutations: mutations,
+        forced_images: forcedImages,
+        pending_images: pendingImages,
+        scroll_y: window.scrollY,
+        height: documentHeight()
+    });
+}
+
+function tick() {
+    var now = Date.now();
+    var height = documentHeight();
+    if (height !== lastHeight) {
+        lastHeight = height;
+        lastChange = now;
+    }
+
+    if (now - started > maxDuration) {
+        return finish("timeout");
+    }
+
+    if (!atBottom) {
+        if (now - lastScroll >= stepInterval) {
+            var scrollY = window.scrollY;
+            window.scrollBy(0, Math.round(window.innerHeight * 0.9));
+            lastScroll = now;
+            steps++;
+            stuckSteps = window.scrollY === scrollY ? stuckSteps + 1 : 0;
+            if (stuckSteps >= maxStuckSteps) {
+                return finish("stuck");
+            }
+        }
+    } else if (pendingImages <= 0 && now - lastChange >= quietPeriod) {
+        return finish("settled");
+    } else if (now - atBottomSince >= maxSettle) {
+        return finish("busy");
+    }
+
+    setTimeout(tick, 50);
+}
+
+tick();
+"""
+
+def scroll_to_bottom(driver, quiet_period=1.0, max_duration=30, step_interval=0.15, max_stuck_steps=10, max_settle=5):
+    driver.set_script_timeout(max_duration + 10)
+    return driver.execute_async_script(SCROLL_SCRIPT, int(quiet_period * 1000), int(max_duration * 1000), int(step_interval * 1000), max_stuck_steps, int(max_settle * 1000))
@@ -4,6 +4,7 @@ import asyncio
 import json
 import datetime
 import re
+import time
 
 import motor.motor_asyncio # async mongodb
 from bson.objectid import ObjectId # used by motor
@@ -15,6 +16,10 @@ import jinja2
 import aiofiles
 
 from buildutil import get_build_folder, get_config_path
+from servermetrics import MetricsRegistry, Counter, Gauge, Histogram, RateWindow
+
+# commands come from clients, anything else is counted as "other" so they cannot create new series
+METRIC_COMMANDS = ["sites", "query"]
 
 async def default_log_func(line):
     print(line)
@@ -150,14 +155,31 @@ async def build_aggregation(data, log_func=default_log_func, pagination=None, fe
     return aggregation
 
 class NewsWall:
-    def __init__(self):
+    def __init__(self, run_stats_window=86400):
         self.clients = {}
         self.running = False
+        self.run_stats_window = run_stats_window
+        self.query_rate = RateWindow()
+
+        self.metrics = MetricsRegistry()
+        self.metric_clients = self.metrics.register(Gauge("newswall_websocket_clients", "Connected WebSocket clients"))
+        self.metric_commands = self.metrics.register(Counter("newswall_commands_total", "WebSocket commands handled"))
+        self.metric_queries_per_second = self.metrics.register(Gauge("newswall_queries_per_second", "Query commands per second over the last minute"))
+        self.metric_command_duration = self.metrics.register(Histogram("newswall_command_duration_seconds", "Time to answer a WebSocket command, including the aggregation"))
+        self.metric_log_poll_duration = self.metrics.register(Histogram("newswall_log_poll_duration_seconds", "Time log_task takes to poll the log collection"))
+        self.metric_log_broadcast_lines = self.metrics.register(Counter("newswall_log_broadcast_lines_total", "Log lines broadcast to clients"))
+        self.metric_broadcast_buffer = self.metrics.register(Gauge("newswall_broadcast_buffer_bytes", "Bytes queued in client transports waiting to be sent"))
+        self.metric_runs = self.metrics.register(Gauge("newswall_scraper_runs", "Scraper runs in the stats window by outcome"))
+        self.metric_run_wall_time = self.metrics.register(Gauge("newswall_scraper_run_wall_time_seconds", "Average wall time of a scraper run in the stats window"))
+        self.metric_run_new_reports = self.metrics.register(Gauge("newswall_scraper_new_reports", "New reports inserted by scraper runs in the stats window"))
+        self.metric_run_peak_rss = self.metrics.register(Gauge("newswall_scraper_peak_rss_bytes", "Highest browser process tree RSS of a scraper run in the stats window"))
+        self.metric_last_run_age = self.metrics.register(Gauge("newswall_scraper_last_run_age_seconds", "Seconds since each scraper last finished"))
 
     def routes(self):
         return [
             web.get('/', self.handle_index),
             web.get('/main', self.handle_websocket),
+            web.get('/metrics', self.handle_metrics),
             web.static('/static', get_build_folder("static")),
             web.static('/images', get_build_folder("images"))
         ]
@@ -182,10 +204,13 @@ class NewsWall:
         self.logs_buffer.reverse()
             
         while self.running:
+            poll_started = time.perf_counter()
             first_log_line_id = self.logs_buffer[0]['_id']
             cursor = self.async_mongodb_database.log.find({'_id': {'$gt': first_log_line_id}}).sort([('_id', -1)])
             temp_logs_buffer = await cursor.to_list(length=100)
             temp_logs_buffer.reverse()
+            self.metric_log_poll_duration.observe(time.perf_counter() - poll_started)
+            self.metric_log_broadcast_lines.inc(len(temp_logs_buffer))
         
             for log_line in temp_logs_buffer:
                 self.logs_buffer.pop(0)
@@ -241,7 +266,8 @@ class NewsWall:
     async def handle_websocket(self, request):
         ws = web.WebSocketResponse()
         await ws.prepare(request)
-        self.clients[ws] = None
+        # the transport is kept to report how much is still waiting to be sent
+        self.clients[ws] = request.transport
 
         async def send(data):
             await ws.send_str(json.dumps(data, default=str))
@@ -252,6 +278,12 @@ class NewsWall:
                     data = json.loads(msg.data)
 
                     if "cmd" in data:
+                        command_started = time.perf_counter()
+                        command_label = data["cmd"] if data["cmd"] in METRIC_COMMANDS else "other"
+                        self.metric_commands.inc(cmd=command_label)
+                        if data["cmd"] == "query":
+                            self.query_rate.add()
+
                         if data["cmd"] == "sites":
                             await send({
                                 "cmd": "sites",
@@ -273,8 +305,57 @@ class NewsWall:
                                 "data": docs,
                                 "prepend": feed_cursor != None
                             })
+
+                        self.metric_command_duration.observe(time.perf_counter() - command_started, cmd=command_label)
         except:
-            del self.clients[ws]
+            pass
+        finally:
+            self.clients.pop(ws, None)
+            self.metric_clients.set(len(self.clients))
+
+    async def collect_run_metrics(self):
+        since = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.run_stats_window)
+        aggregation = [
+            {"$match": {"started": {"$gte": since}}},
+            {"$group": {
+                "_id": {"site": "$site", "outcome": {"$ifNull": ["$outcome", "unknown"]}},
+                "runs": {"$sum": 1},
+                "wall_time": {"$avg": "$wall_time"},
+                "new_reports": {"$sum": "$new_reports"},
+                "peak_rss": {"$max": "$peak_rss"}
+            }}
+        ]
+
+        for metric in [self.metric_runs, self.metric_run_wall_time, self.metric_run_new_reports, self.metric_run_peak_rss, self.metric_last_run_age]:
+            metric.clear()
+
+        async for stats in self.async_mongodb_database["runs"].aggregate(aggregation):
+            labels = {"site": stats["_id"]["site"], "outcome": stats["_id"]["outcome"]}
+            self.metric_runs.set(stats["runs"], **labels)
+            self.metric_run_wall_time.set(stats["wall_time"] or 0, **labels)
+            self.metric_run_new_reports.set(stats["new_reports"], **labels)
+            self.metric_run_peak_rss.set(stats["peak_rss"] or 0, **labels)
+
+        now = time.time()
+        async for state in self.async_mongodb_database["schedule"].find({"last_run": {"$exists": True}}, {"last_run": 1}):
+            self.metric_last_run_age.set(now - state["last_run"], site=state["_id"])
+
+    async def handle_metrics(self, request):
+        self.metric_clients.set(len(self.clients))
+        self.metric_queries_per_second.set(self.query_rate.rate())
+
+        broadcast_buffer = 0
+        for transport in list(self.clients.values()):
+            if transport != None and not transport.is_closing():
+                broadcast_buffer += transport.get_write_buffer_size()
+        self.metric_broadcast_buffer.set(broadcast_buffer)
+
+        try:
+            await self.collect_run_metrics()
+        except Exception as e:
+            await self.async_log("Failed to collect scraper run metrics: %s" % str(e))
+
+        return web.Response(text=self.metrics.render(), content_type="text/plain", charset="utf-8")
 
     async def stop(self):
         await self.async_log("Shutting down asynchronous MongoDB client")
@@ -0,0 +1,110 @@
+import time
+import collections
+
+DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for name, value in labels) + "}"
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if type(value) == float else str(value)
+
+class Metric:
+    def __init__(self, name, help, metric_type):
+        self.name = name
+        self.help = help
+        self.metric_type = metric_type
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(sorted(labels.items()))
+
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def clear(self):
+        self.values = {}
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, key, value
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.metric_type)]
+        for name, labels, value in self.samples():
+            lines.append("%s%s %s" % (name, format_labels(labels), format_value(value)))
+        return lines
+
+class Counter(Metric):
+    def __init__(self, name, help):
+        Metric.__init__(self, name, help, "counter")
+
+class Gauge(Metric):
+    def __init__(self, name, help):
+        Metric.__init__(self, name, help, "gauge")
+
+class Histogram(Metric):
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, help, "histogram")
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        if not key in self.values:
+            self.values[key] = {"buckets": [0] * len(self.buckets), "sum": 0, "count": 0}
+        histogram = self.values[key]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                histogram["buckets"][index] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+    def samples(self):
+        for key, histogram in self.values.items():
+            for bound, count in zip(self.buckets, histogram["buckets"]):
+                yield self.name + "_bucket", key + (("le", format_value(float(bound))),), count
+            yield self.name + "_bucket", key + (("le", "+Inf"),), histogram["count"]
+            yield self.name + "_sum", key, histogram["sum"]
+            yield self.name + "_count", key, histogram["count"]
+
+class RateWindow:
+    def __init__(self, window=60):
+        self.window = window
+        self.events = collections.deque()
+
+    def prune(self, now):
+        horizon = now - self.window
+        while len(self.events) > 0 and self.events[0] < horizon:
+            self.events.popleft()
+
+    def add(self):
+        # pruned here too, /metrics may never be scraped
+        now = time.time()
+        self.prune(now)
+        self.events.append(now)
+
+    def rate(self):
+        self.prune(time.time())
+        return len(self.events) / self.window
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
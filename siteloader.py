@@ -0,0 +1,37 @@
+import os
+import sys
+import ast
+import threading
+import importlib.util
+
+class SiteNotFoundException(Exception):
+    pass
+
+site_modules = {}
+site_modules_lock = threading.Lock()
+
+def import_site(path):
+    with site_modules_lock:
+        if path in site_modules:
+            return site_modules[path]
+        site_modules[path] = exec_site(path)
+        return site_modules[path]
+
+def exec_site(path):
+    if not os.path.exists(path):
+        raise SiteNotFoundException("The script referenced existing at '%s' was not found." % (path))
+    name = os.path.basename(os.path.splitext(path)[0])
+    spec = importlib.util.spec_from_file_location(name, path)
+    site = importlib.util.module_from_spec(spec)
+    sys.modules[name] = site
+    spec.loader.exec_module(site)
+    return site
+
+def declares_class(path, class_name):
+    # parses without executing, so the site's selenium and PIL imports are left for the process that runs it
+    with open(path) as f:
+        tree = ast.parse(f.read(), filename=path)
+    return any(type(node) == ast.ClassDef and node.name == class_name for node in tree.body)
+
+def load_site_class(path, class_name):
+    return getattr(import_site(path), class_name)
@@ -1,11 +1,7 @@
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.action_chains import ActionChains
 
-from PIL import Image, ImageChops
-
 from io import BytesIO
 import datetime
 import time
@@ -26,20 +22,23 @@ class AssociatedPress:
             self.xdotool.size("100%", "100%")
         except Exception as e:
             exception_str = traceback.format_exc()
-            self.helper.log("Failed during setup", exception=exception_str)
+            self.helper.log("Failed during setup", exception=exception_str, fatal=True)
             self.helper.stop()
             return
 
         self.helper.log("Fetching Associated Press")
 
+        @self.helper.timed()
         def navigate():
             self.helper.log("Navigating to page: %s" % (self.url))
             self.driver.get(self.url)
 
+        @self.helper.timed()
         def wait_for_page_ready(interval):
             self.helper.log("Waiting for page")
-            WebDriverWait(self.driver, interval).until(EC.presence_of_element_located((By.CSS_SELECTOR, ".cnx-playspace-container")))
+            self.helper.sync_wait_until_ready((By.CSS_SELECTOR, ".cnx-playspace-container"), interval)
         
+        @self.helper.timed()
         def check_cookie_disclaimer():
             try:
                 consent_elements = self.driver.find_elements(By.CSS_SELECTOR, "#onetrust-accept-btn-handler")
@@ -49,38 +48,26 @@ class AssociatedPress:
             except:
                 self.helper.log("Failed to find cookie disclaimer")
 
+        @self.helper.timed()
         def save_element_image(element, file):
-            location = element.location_once_scrolled_into_view
-            png = self.driver.get_screenshot_as_png() # saves screenshot of entire page
-
-            im = Image.open(BytesIO(png)) # uses PIL library to open image in memory
-
-            left = location['x']
-            top = location['y']
-            
-            size = self.driver.execute_script("var element = arguments[0]; return [element.offsetWidth, element.offsetHeight]", element)
-            width = size[0]
-            height = size[1]
-
-            if width == 0 or height == 0:
+            im = self.helper.sync_element_screenshot(element)
+            if im == None:
                 return False
-
-            right = left + width
-            bottom = top + height
-
-            im = im.crop((left, top, right, bottom))
             
-            im.save(file)
+            self.helper.save_image(im, file)
             return True
 
+        @self.helper.timed()
         def save_articles():
             self.helper.log("Saving articles")
+            self.helper.sync_prefetch_known_reports()
 
             self.driver.execute_script("document.querySelector('.Header').remove()")
             
             main_story = self.driver.find_elements(By.CSS_SELECTOR, "[data-key='main-story']")
             main_story_container = self.driver.execute_script("return arguments[0].children[0]", main_story[0])
             main_story_container_children = self.driver.execute_script("return arguments[0].children", main_story_container)
+            self.helper.sync_prefetch_element_rects(main_story_container_children)
             i = 0
 
             for article in main_story_container_children:
@@ -120,8 +107,8 @@ class AssociatedPress:
                     article_data["title"] = article_link_element.find_element(By.CSS_SELECTOR, "h2, h3").get_attribute("innerText")
                     article_data["timestamp"] = article.find_element(By.CSS_SELECTOR, ".Timestamp").get_attribute("data-source")
 
-                    report = self.helper.sync_report(article_id, article_data)
-                    self.helper.log("Inserted report %s: %s" % (article_id, report.inserted_id))
+                    report_id = self.helper.sync_report(article_id, article_data)
+                    self.helper.log("Queued report %s: %s" % (article_id, report_id))
                 else:
                     self.helper.sync_insert_presence(article_db_obj.get('_id'), datetime.datetime.utcnow())
                     self.helper.log("Inserted presence into %s" % article_id)
@@ -148,6 +135,8 @@ class AssociatedPress:
                         else:
                             time.sleep(1)
 
+                    # the carousel has moved on since the last capture at this scroll position
+                    self.helper.sync_invalidate_screenshots()
                     article_screenshot_paths = self.helper.get_image_path(article_id)
                     save_element_image(feed_card_ss_element, article_screenshot_paths["path"])
                     article_data["screenshot_url"] = article_screenshot_paths["url"]
@@ -155,24 +144,27 @@ class AssociatedPress:
 
                     article_title_element.click()
                     time.sleep(1)
-                    WebDriverWait(self.driver, 10).until(EC.presence_of_element_located((By.ID, "root")))
-                    time.sleep(5)
+                    self.helper.sync_wait_until_ready((By.ID, "root"), 10)
 
                     article_data["url"] = self.driver.current_url
                     article_data["section"] = "Trending News"
                     self.driver.get(self.url)
-                    WebDriverWait(self.driver, 10).until(EC.presence_of_element_located((By.ID, "root")))
+                    self.helper.sync_wait_until_ready((By.ID, "root"), 10)
                     self.driver.execute_script("document.querySelector('.Header').remove()")
+                    # the reloaded page no longer matches the cached viewport
+                    self.helper.sync_invalidate_screenshots()
 
-                    report = self.helper.sync_report(article_id, article_data)
-                    self.helper.log("Inserted report %s: %s" % (article_id, report.inserted_id))
+                    report_id = self.helper.sync_report(article_id, article_data)
+                    self.helper.log("Queued report %s: %s" % (article_id, report_id))
                 else:
                     self.helper.sync_insert_presence(article_db_obj.get('_id'), datetime.datetime.utcnow())
                     self.helper.log("Inserted presence into %s" % article_id)
             
             self.helper.scroll_down_page(4)
+            self.helper.sync_prefetch_known_reports()
 
             articles = self.driver.find_elements(By.CSS_SELECTOR, ".hubPeekStory")
+            self.helper.sync_prefetch_element_rects(articles)
 
             for article in articles:
                 article_data = {}
@@ -193,13 +185,14 @@ class AssociatedPress:
                     except:
                         pass
 
-                    report = self.helper.sync_report(article_id, article_data)
-                    self.helper.log("Inserted report %s: %s" % (article_id, report.inserted_id))
+                    report_id = self.helper.sync_report(article_id, article_data)
+                    self.helper.log("Queued report %s: %s" % (article_id, report_id))
                 else:
                     self.helper.sync_insert_presence(article_db_obj.get('_id'), datetime.datetime.utcnow())
                     self.helper.log("Inserted presence into %s" % article_id)
                     
             articles = self.driver.find_elements(By.CSS_SELECTOR, ".FeedCard[data-card-id][data-key]")
+            self.helper.sync_prefetch_element_rects(articles)
             for article in articles:
                 article_data = {}
                 article_link_element = article.find_element(By.CSS_SELECTOR, "a[data-key='card-headline']")
@@ -223,14 +216,15 @@ class AssociatedPress:
                     except:
                         article_data["author"] = None
 
-                    report = self.helper.sync_report(article_id, article_data)
-                    self.helper.log("Inserted report %s: %s" % (article_id, report.inserted_id))
+                    report_id = self.helper.sync_report(article_id, article_data)
+                    self.helper.log("Queued report %s: %s" % (article_id, report_id))
                 else:
                     self.helper.sync_insert_presence(article_db_obj.get('_id'), datetime.datetime.utcnow())
                     self.helper.log("Inserted presence into %s" % article_id)
 
                     
             articles = self.driver.find_elements(By.CSS_SELECTOR, "[data-card-index]")
+            self.helper.sync_prefetch_element_rects(articles)
             for article in articles:
                 article_data = {}
                 article_link_element = article.find_element(By.CSS_SELECTOR, "a.item-label-href")
@@ -258,19 +252,18 @@ class AssociatedPress:
                     except:
                         article_data["description"] = None
 
-                    report = self.helper.sync_report(article_id, article_data)
-                    self.helper.log("Inserted report %s: %s" % (article_id, report.inserted_id))
+                    report_id = self.helper.sync_report(article_id, article_data)
+                    self.helper.log("Queued report %s: %s" % (article_id, report_id))
                 else:
                     self.helper.sync_insert_presence(article_db_obj.get('_id'), datetime.datetime.utcnow())
                     self.helper.log("Inserted presence into %s" % article_id)
         try:
             navigate()
             wait_for_page_ready(self.helper.interval_page_ready())
-            time.sleep(1)
             check_cookie_disclaimer()
             save_articles()
         except Exception as e:
-            self.helper.log("Failed waiting for site: %s" % (str(e)), exception=traceback.format_exc())
+            self.helper.log("Failed waiting for site: %s" % (str(e)), exception=traceback.format_exc(), fatal=True)
             self.helper.log("Shutting down")
         finally:
             self.helper.stop()
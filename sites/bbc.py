@@ -1,10 +1,8 @@
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.action_chains import ActionChains
 
-from PIL import Image, ImageChops
+from PIL import Image
 from io import BytesIO
 import datetime
 import hashlib
@@ -26,20 +24,23 @@ class BBC:
             self.xdotool.size("100%", "100%")
         except Exception as e:
             exception_str = traceback.format_exc()
-            self.helper.log("Failed during setup", exception=exception_str)
+            self.helper.log("Failed during setup", exception=exception_str, fatal=True)
             self.helper.stop()
             return
 
         self.helper.log("Fetching BBC")
 
+        @self.helper.timed()
         def navigate():
             self.helper.log("Navigating to page: %s" % (self.url))
             self.driver.get(self.url)
 
+        @self.helper.timed()
         def wait_for_page_ready(interval):
             self.helper.log("Waiting for page")
-            WebDriverWait(self.driver, interval).until(EC.presence_of_element_located((By.ID, "orb-modules")))
+            self.helper.sync_wait_until_ready((By.ID, "orb-modules"), interval)
         
+        @self.helper.timed()
         def check_cookie_disclaimer():
             try:
                 consent_buttons = self.driver.find_elements(By.CSS_SELECTOR, "#bbccookies-continue-button")
@@ -48,6 +49,7 @@ class BBC:
                 exception_str = traceback.format_exc()
                 self.helper.log("Failed to find cookie disclaimer", exception=exception_str)
         
+        @self.helper.timed()
         def check_cookie_disclaimer_2():
             try:
                 consent_buttons = self.driver.find_elements(By.CSS_SELECTOR, ".fc-cta-consent")
@@ -57,47 +59,26 @@ class BBC:
                 exception_str = traceback.format_exc()
                 self.helper.log("Failed to find cookie disclaimer 2", exception=exception_str)
 
+        @self.helper.timed()
         def save_element_image_2(element, file):
             if element.size['width'] > 0 or element.size['height'] > 0:
-                element.screenshot(file)
+                self.helper.save_image(Image.open(BytesIO(element.screenshot_as_png)), file)
+                # the element screenshot scrolled the page behind the screenshot service's back
+                self.helper.sync_invalidate_screenshots()
                 return True
             else:
                 return False
 
-        def save_element_image(element, file):
-            location = element.location_once_scrolled_into_view
-            png = self.driver.get_screenshot_as_png() # saves screenshot of entire page
-
-            im = Image.open(BytesIO(png)) # uses PIL library to open image in memory
-
-            left = location['x']
-            top = location['y']
-            
-            size = self.driver.execute_script("var element = arguments[0]; return [element.offsetWidth, element.offsetHeight]", element)
-            width = size[0]
-            height = size[1]
-
-            if width == 0 or height == 0:
+        @self.helper.timed()
+        def save_element_image(element, rect, file):
+            im = self.helper.sync_rect_screenshot(element, rect)
+            if im == None:
                 return False
 
-            right = left + width
-            bottom = top + height
-
-            im = im.crop((left, top, right, bottom))
-
-            def trim(im):
-                bg = Image.new(im.mode, im.size, (255,255,255))
-                diff = ImageChops.difference(im, bg)
-                diff = ImageChops.add(diff, diff, 2.0, -100)
-                bbox = diff.getbbox()
-                if bbox:
-                    return im.crop(bbox)
-                else:
-                    return trim(im.convert('RGB'))
-            
-            trim(im).save(file)
+            self.helper.save_image(im, file, trim=True)
             return True
 
+        @self.helper.timed()
         def save_articles(category=None):
 
             self.helper.log("Saving articles for '%s'" % ("Front Page" if category == None else category))
@@ -115,22 +96,46 @@ class BBC:
                 self.driver.get(self.categories[category])
 
                 wait_for_page_ready(self.helper.interval_page_ready())
-                time.sleep(10)
                 check_cookie_disclaimer()
                 check_cookie_disclaimer_2()
 
-            promos = self.driver.find_elements(By.CSS_SELECTOR, ".gs-c-promo")
-
-            for article in promos:
+            self.helper.sync_prefetch_known_reports()
+            promos, qas = self.helper.sync_extract([
+                {
+                    "selector": ".gs-c-promo",
+                    "fields": {
+                        "url": {"selector": [".gs-c-promo-heading", "a"], "property": "href"},
+                        "title": {"selector": [".gs-c-promo-heading__title", ".gs-c-promo-heading", "a"]},
+                        "summary": {"selector": ".gs-c-promo-summary"},
+                        "datetime": {"selector": ".date", "attribute": "datetime"},
+                        "section": {"selector": ".gs-c-section-link"},
+                        "section_url": {"selector": ".gs-c-section-link", "property": "href"}
+                    }
+                },
+                {
+                    "selector": ".qa-post",
+                    "fields": {
+                        "title": {"selector": ".lx-stream-post__header-text"},
+                        "url": {"selector": ".qa-heading-link", "property": "href"},
+                        "url_tag": {"selector": ".qa-heading-link", "property": "tagName"},
+                        "summary": {"selector": ".qa-story-summary"},
+                        "datetime": {"selector": ".lx-stream-post__meta-time .qa-post-auto-meta"},
+                        "contributor_name": {"selector": ".qa-contributor-name"},
+                        "contributor_role": {"selector": ".qa-contributor-role"},
+                        "section": {"selector": ".gs-c-section-link"},
+                        "section_url": {"selector": ".gs-c-section-link", "property": "href"},
+                        "body": {"selector": ".lx-stream-post-body"}
+                    }
+                }
+            ])
+
+            for promo in promos:
+                fields = promo["fields"]
                 article_data = {}
-                try:
-                    article_link_element = article.find_element(By.CSS_SELECTOR, ".gs-c-promo-heading")
-                    if article_link_element.tag_name != "a":
-                        continue
-                    article_data["url"] = article_link_element.get_attribute("href")
-                except:
-                    article_link_element = article.find_element(By.CSS_SELECTOR, "a")
-                    article_data["url"] = article_link_element.get_attribute("href")
+                # a heading that is not a link has no href
+                if fields["url"] == None:
+                    continue
+                article_data["url"] = fields["url"]
 
                 article_id = hashlib.sha256(article_data["url"].encode("ascii")).hexdigest()
                 self.helper.log("Saving article %s <%s>" % (article_id, article_data["url"]))
@@ -140,35 +145,18 @@ class BBC:
                     self.helper.log("Saving %s" % (article_data["url"]))
 
                     article_screenshot_paths = self.helper.get_image_path(article_id)
-                    article_screenshot_saved = save_element_image(article, article_screenshot_paths["path"])
+                    article_screenshot_saved = save_element_image(promo["element"], promo["rect"], article_screenshot_paths["path"])
                     if article_screenshot_saved:
                         article_data["screenshot_url"] = article_screenshot_paths["url"]
                         article_data["screenshot_path"] = article_screenshot_paths["path"]
                     else:
                         self.helper.log("Failed to save article image %s" % (article_data["url"]))
 
-                    try:
-                        article_data["title"] = article.find_element(By.CSS_SELECTOR, ".gs-c-promo-heading__title").get_attribute("innerText")
-                    except:
-                        article_data["title"] = article_link_element.get_attribute("innerText")
-
-                    try:
-                        article_data["summary"] = article.find_element(By.CSS_SELECTOR, ".gs-c-promo-summary").get_attribute("innerText")
-                    except:
-                        article_data["summary"] = None
-
-                    try:
-                        article_data["datetime"] = article.find_element(By.CSS_SELECTOR, ".date").get_attribute("datetime")
-                    except:
-                        article_data["datetime"] = None
-
-                    try:
-                        section_link_element = article.find_element(By.CSS_SELECTOR, ".gs-c-section-link")
-                        article_data["section"] = section_link_element.get_attribute("innerText").strip()
-                        article_data["section_url"] = section_link_element.get_attribute("href")
-                    except:
-                        article_data["section"] = None
-                        article_data["section_url"] = None
+                    article_data["title"] = fields["title"]
+                    article_data["summary"] = fields["summary"]
+                    article_data["datetime"] = fields["datetime"]
+                    article_data["section"] = fields["section"].strip() if fields["section"] != None else None
+                    article_data["section_url"] = fields["section_url"] if fields["section"] != None else None
 
                     if category == None:
                         article_data["category"] = "Front Page"
@@ -177,24 +165,23 @@ class BBC:
                         article_data["category"] = category
                         article_data["category_url"] = self.categories[category]
 
-                    report = self.helper.sync_report(article_id, article_data)
-                    self.helper.log("Inserted report %s: %s" % (article_id, report.inserted_id))
+                    report_id = self.helper.sync_report(article_id, article_data)
+                    self.helper.log("Queued report %s: %s" % (article_id, report_id))
                 else:
                     self.helper.sync_insert_presence(article_db_obj.get('_id'), datetime.datetime.utcnow())
                     self.helper.log("Inserted presence into %s" % article_id)
 
-            qas = self.driver.find_elements(By.CSS_SELECTOR, ".qa-post")
-
-            for article in qas:
+            for qa in qas:
+                article = qa["element"]
+                fields = qa["fields"]
                 article_data = {}
-                article_title = article.find_element(By.CSS_SELECTOR, ".lx-stream-post__header-text").get_attribute("innerText")
-                try:
-                    article_link_element = article.find_element(By.CSS_SELECTOR, ".qa-heading-link")
-                    if article_link_element.tag_name != "a":
-                        continue
-                    article_data["url"] = article_link_element.get_attribute("href")
-                except:
+                article_title = fields["title"]
+                if fields["url_tag"] == None:
                     article_data["url"] = self.categories[category]
+                elif fields["url_tag"] != "A":
+                    continue
+                else:
+                    article_data["url"] = fields["url"]
                 article_id = hashlib.sha256(article_title.encode()).hexdigest()
 
                 article_db_obj = self.helper.sync_find_if_exists(article_id)
@@ -202,7 +189,7 @@ class BBC:
                     self.helper.log("Saving %s" % (article_data["url"]))
 
                     article_screenshot_paths = self.helper.get_image_path(article_id)
-                    article_screenshot_saved = save_element_image(article, article_screenshot_paths["path"])
+                    article_screenshot_saved = save_element_image(article, qa["rect"], article_screenshot_paths["path"])
                     if article_screenshot_saved:
                         article_data["screenshot_url"] = article_screenshot_paths["url"]
                         article_data["screenshot_path"] = article_screenshot_paths["path"]
@@ -216,39 +203,13 @@ class BBC:
                             self.helper.log("Failed to save article image using second method %s" % (article_data["url"]))
 
                     article_data["title"] = article_title
-                    
-                    try:
-                        article_data["summary"] = article.find_element(By.CSS_SELECTOR, ".qa-story-summary").get_attribute("innerText")
-                    except:
-                        article_data["summary"] = None
-
-                    try:
-                        article_data["datetime"] = article.find_element(By.CSS_SELECTOR, ".lx-stream-post__meta-time .qa-post-auto-meta").get_attribute("innerText")
-                    except:
-                        article_data["datetime"] = None
-
-                    try:
-                        article_data["contributor_name"] = article.find_element(By.CSS_SELECTOR, ".qa-contributor-name").get_attribute("innerText")
-                    except:
-                        article_data["contributor_name"] = None
-
-                    try:
-                        article_data["contributor_role"] = article.find_element(By.CSS_SELECTOR, ".qa-contributor-role").get_attribute("innerText")
-                    except:
-                        article_data["contributor_role"] = None
-
-                    try:
-                        section_link_element = article.find_element(By.CSS_SELECTOR, ".gs-c-section-link")
-                        article_data["section"] = section_link_element.get_attribute("innerText").strip()
-                        article_data["section_url"] = section_link_element.get_attribute("href")
-                    except:
-                        article_data["section"] = None
-                        article_data["section_url"] = None
-
-                    try:
-                        article_data["body"] = article.find_element(By.CSS_SELECTOR, ".lx-stream-post-body").get_attribute("innerText")
-                    except:
-                        article_data["body"] = None
+                    article_data["summary"] = fields["summary"]
+                    article_data["datetime"] = fields["datetime"]
+                    article_data["contributor_name"] = fields["contributor_name"]
+                    article_data["contributor_role"] = fields["contributor_role"]
+                    article_data["section"] = fields["section"].strip() if fields["section"] != None else None
+                    article_data["section_url"] = fields["section_url"] if fields["section"] != None else None
+                    article_data["body"] = fields["body"]
 
                     if category == None:
                         article_data["category"] = "Front Page"
@@ -257,8 +218,8 @@ class BBC:
                         article_data["category"] = category
                         article_data["category_url"] = self.categories[category]
 
-                    report = self.helper.sync_report(article_id, article_data)
-                    self.helper.log("Inserted report %s: %s" % (article_id, report.inserted_id))
+                    report_id = self.helper.sync_report(article_id, article_data)
+                    self.helper.log("Queued report %s: %s" % (article_id, report_id))
                 else:
                     self.helper.sync_insert_presence(article_db_obj.get('_id'), datetime.datetime.utcnow())
                     self.helper.log("Inserted presence into %s" % article_id)
@@ -272,7 +233,6 @@ class BBC:
             navigate()
                 
             wait_for_page_ready(self.helper.interval_page_ready())
-            time.sleep(10)
             check_cookie_disclaimer()
             check_cookie_disclaimer_2()
             #time.sleep(2)
@@ -281,7 +241,7 @@ class BBC:
             #scroll_down_page()
             save_articles()
         except Exception as e:
-            self.helper.log("Failed waiting for site: %s" % (str(e)), exception=traceback.format_exc())
+            self.helper.log("Failed waiting for site: %s" % (str(e)), exception=traceback.format_exc(), fatal=True)
             self.helper.log("Shutting down")
         finally:
             self.helper.stop()
\ No newline at end of file
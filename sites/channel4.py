@@ -1,6 +1,4 @@
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.action_chains import ActionChains
 
@@ -29,20 +27,23 @@ class Channel4:
             self.xdotool.size("100%", "100%")
         except Exception as e:
             exception_str = traceback.format_exc()
-            self.helper.log("Failed during setup", exception=exception_str)
+            self.helper.log("Failed during setup", exception=exception_str, fatal=True)
             self.helper.stop()
             return
 
         self.helper.log("Fetching Channel 4 News")
 
+        @self.helper.timed()
         def navigate():
             self.helper.log("Navigating to page: %s" % (self.url))
             self.driver.get(self.url)
 
+        @self.helper.timed()
         def wait_for_page_ready(interval):
             self.helper.log("Waiting for page")
-            WebDriverWait(self.driver, interval).until(EC.presence_of_element_located((By.ID, "site-body")))
+            self.helper.sync_wait_until_ready((By.ID, "site-body"), interval)
 
+        @self.helper.timed()
         def check_cookie_disclaimer():
             self.xdotool.scroll_down()
             self.xdotool.scroll_down()
@@ -57,6 +58,7 @@ class Channel4:
             except:
                 self.helper.log("Failed to find cookie disclaimer")
         
+        @self.helper.timed()
         def scroll_down_page_and_save():
             # https://stackoverflow.com/a/46816183
             # sytech
@@ -91,6 +93,7 @@ class Channel4:
             
             articles = self.driver.find_elements(By.CSS_SELECTOR, "ul.stream > li")
             articles_saved = []
+            self.helper.sync_prefetch_known_reports()
 
             while True:
                 if scroll_attempts_failed == 10:
@@ -117,8 +120,8 @@ class Channel4:
                             article_data["title"] = article_link_element.find_element(By.CSS_SELECTOR, ".heading").get_attribute("innerText")
                             article_data["description"] = article.find_element(By.CSS_SELECTOR, ".description").get_attribute("innerText")
 
-                            report = self.helper.sync_report(article_id, article_data)
-                            self.helper.log("Inserted report %s: %s" % (article_id, report.inserted_id))
+                            report_id = self.helper.sync_report(article_id, article_data)
+                            self.helper.log("Queued report %s: %s" % (article_id, report_id))
                         else:
                             self.helper.sync_insert_presence(article_db_obj.get('_id'), datetime.datetime.utcnow())
                             self.helper.log("Inserted presence into %s" % article_id)
@@ -134,9 +137,10 @@ class Channel4:
                     scroll_attempts_failed = 0
                 last_scroll_y = scroll_y
 
+        @self.helper.timed()
         def save_element_image(element, file):
             im = Image.open(BytesIO(element.screenshot_as_png)) # uses PIL library to open image in memory
-            im.save(file)
+            self.helper.save_image(im, file)
             return True
 
         try:
@@ -144,9 +148,8 @@ class Channel4:
             wait_for_page_ready(self.helper.interval_page_ready())
             check_cookie_disclaimer()
             scroll_down_page_and_save()
-            time.sleep(3600)
         except Exception as e:
-            self.helper.log("Failed waiting for site: %s" % (str(e)), exception=traceback.format_exc())
+            self.helper.log("Failed waiting for site: %s" % (str(e)), exception=traceback.format_exc(), fatal=True)
             self.helper.log("Shutting down")
         finally:
             self.helper.stop()
@@ -1,11 +1,7 @@
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.action_chains import ActionChains
 
-from PIL import Image, ImageChops
-
 from io import BytesIO
 import base64
 import os
@@ -28,20 +24,23 @@ class HackerNews:
             self.xdotool.size("100%", "100%")
         except Exception as e:
             exception_str = traceback.format_exc()
-            self.helper.log("Failed during setup", exception=exception_str)
+            self.helper.log("Failed during setup", exception=exception_str, fatal=True)
             self.helper.stop()
             return
 
         self.helper.log("Fetching Hacker News")
 
+        @self.helper.timed()
         def navigate():
             self.helper.log("Navigating to page: %s" % (self.url))
             self.driver.get(self.url)
 
+        @self.helper.timed()
         def wait_for_page_ready(interval):
             self.helper.log("Waiting for page")
-            WebDriverWait(self.driver, interval).until(EC.presence_of_element_located((By.ID, "hnmain")))
+            self.helper.sync_wait_until_ready((By.ID, "hnmain"), interval)
         
+        @self.helper.timed()
         def check_cookie_disclaimer():
             try:
                 consent_elements = self.driver.find_elements(By.CSS_SELECTOR, "[value='Accept All Cookies']")
@@ -52,81 +51,65 @@ class HackerNews:
             except:
                 self.helper.log("Failed to find cookie disclaimer")
 
-        def save_element_image(element, element2, file):
-            location = element.location_once_scrolled_into_view
-            png = self.driver.get_screenshot_as_png() # saves screenshot of entire page
-
-            im = Image.open(BytesIO(png)) # uses PIL library to open image in memory
-
-            left = location['x']
-            top = location['y']
-            
-            size = self.driver.execute_script("var element = arguments[0]; return [element.offsetWidth, element.offsetHeight]", element)
-            width = size[0]
-            height = size[1]
+        @self.helper.timed()
+        def save_element_image(element, rect, post_size, file):
+            left, top, width, height = rect
 
             if width == 0 or height == 0:
                 return False
 
-            right = left + width
-            bottom = top + height
+            # the post row below the title row is part of the capture
+            rect = [left, top, width + post_size[0], height + post_size[1] + 7]
+            im = self.helper.sync_rect_screenshot(element, rect)
 
-            size_element2 = self.driver.execute_script("var element = arguments[0]; return [element.offsetWidth, element.offsetHeight]", element2)
-            right += size_element2[0]
-            bottom += size_element2[1] + 7
-
-            im = im.crop((left, top, right, bottom))
-
-            def trim(im):
-                bg = Image.new(im.mode, im.size, (255, 255, 255))
-                diff = ImageChops.difference(im, bg)
-                diff = ImageChops.add(diff, diff, 2.0, -100)
-                bbox = diff.getbbox()
-                if bbox:
-                    return im.crop(bbox)
-                else:
-                    return trim(im.convert('RGB'))
-            
-            trim(im).save(file)
+            self.helper.save_image(im, file, trim=True)
             return True
             
+        @self.helper.timed()
         def save_articles():
             self.helper.log("Saving articles")
-
-            articles = self.driver.find_elements(By.CSS_SELECTOR, ".athing")
+            self.helper.sync_prefetch_known_reports()
+
+            articles = self.helper.sync_extract({
+                "selector": ".athing",
+                "fields": {
+                    "url": {"selector": ".titleline > a", "property": "href"},
+                    "title": {"selector": ".titleline > a"},
+                    "post_width": {"root": "next", "property": "offsetWidth"},
+                    "post_height": {"root": "next", "property": "offsetHeight"},
+                    "age": {"root": "next", "selector": ".age", "attribute": "title"},
+                    "score": {"root": "next", "selector": ".score"},
+                    "user": {"root": "next", "selector": ".hnuser"},
+                    "user_url": {"root": "next", "selector": ".hnuser", "property": "href"},
+                    "comments": {"root": "next", "selector": "a", "index": -1},
+                    "comments_url": {"root": "next", "selector": "a", "index": -1, "property": "href"}
+                }
+            })
 
             for article in articles:
-                article_post_data = self.driver.execute_script("return arguments[0].nextElementSibling", article)
+                fields = article["fields"]
                 article_data = {}
-                article_link_element = article.find_element(By.CSS_SELECTOR, ".titleline > a")
-                article_data["url"] = article_link_element.get_attribute("href")
+                article_data["url"] = fields["url"]
                 article_id = hashlib.sha256(article_data["url"].encode("ascii")).hexdigest()
 
                 article_db_obj = self.helper.sync_find_if_exists(article_id)
                 if article_db_obj == None:
+                    if fields["score"] == None or fields["user"] == None:
+                        continue
                     article_screenshot_paths = self.helper.get_image_path(article_id)
-                    save_element_image(article, article_post_data, article_screenshot_paths["path"])
+                    save_element_image(article["element"], article["rect"], (fields["post_width"] or 0, fields["post_height"] or 0), article_screenshot_paths["path"])
                     article_data["screenshot_url"] = article_screenshot_paths["url"]
                     article_data["screenshot_path"] = article_screenshot_paths["path"]
-                    article_data["title"] = article_link_element.get_attribute("innerText")
-                    article_data["age"] = article_post_data.find_element(By.CSS_SELECTOR, ".age").get_attribute("title")
-                    try:
-                        article_data["score"] = article_post_data.find_element(By.CSS_SELECTOR, ".score").get_attribute("innerText")
-                    except:
-                        continue
-                    try:
-                        article_user = article_post_data.find_element(By.CSS_SELECTOR, ".hnuser")
-                    except:
-                        continue
-                    article_data["user"] = article_user.get_attribute("innerText")
-                    article_data["user_url"] = article_user.get_attribute("href")
-                    article_post_data_links = article_post_data.find_elements(By.CSS_SELECTOR, "a")
-                    article_comments_link = article_post_data_links[len(article_post_data_links) - 1]
-                    article_data["comments"] = article_comments_link.get_attribute("innerText")
-                    article_data["comments_url"] = article_comments_link.get_attribute("href")
-
-                    report = self.helper.sync_report(article_id, article_data)
-                    self.helper.log("Inserted report %s: %s" % (article_id, report.inserted_id))
+                    article_data["title"] = fields["title"]
+                    article_data["age"] = fields["age"]
+                    article_data["score"] = fields["score"]
+                    article_data["user"] = fields["user"]
+                    article_data["user_url"] = fields["user_url"]
+                    article_data["comments"] = fields["comments"]
+                    article_data["comments_url"] = fields["comments_url"]
+
+                    report_id = self.helper.sync_report(article_id, article_data)
+                    self.helper.log("Queued report %s: %s" % (article_id, report_id))
                 else:
                     self.helper.sync_insert_presence(article_db_obj.get('_id'), datetime.datetime.utcnow())
                     self.helper.log("Inserted presence into %s" % article_id)
@@ -137,7 +120,7 @@ class HackerNews:
             check_cookie_disclaimer()
             save_articles()
         except Exception as e:
-            self.helper.log("Failed waiting for site: %s" % (str(e)), exception=traceback.format_exc())
+            self.helper.log("Failed waiting for site: %s" % (str(e)), exception=traceback.format_exc(), fatal=True)
             self.helper.log("Shutting down")
         finally:
             self.helper.stop()
\ No newline at end of file
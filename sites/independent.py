@@ -1,11 +1,7 @@
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.action_chains import ActionChains
 
-from PIL import Image, ImageChops
-
 from io import BytesIO
 import base64
 import os
@@ -28,20 +24,23 @@ class Independent:
             self.xdotool.size("100%", "100%")
         except Exception as e:
             exception_str = traceback.format_exc()
-            self.helper.log("Failed during setup", exception=exception_str)
+            self.helper.log("Failed during setup", exception=exception_str, fatal=True)
             self.helper.stop()
             return
 
         self.helper.log("Fetching Independent")
 
+        @self.helper.timed()
         def navigate():
             self.helper.log("Navigating to page: %s" % (self.url))
             self.driver.get(self.url)
 
+        @self.helper.timed()
         def wait_for_page_ready(interval):
             self.helper.log("Waiting for page")
-            WebDriverWait(self.driver, interval).until(EC.presence_of_element_located((By.ID, "sectionContent")))
+            self.helper.sync_wait_until_ready((By.ID, "sectionContent"), interval)
 
+        @self.helper.timed()
         def check_cookie_disclaimer():
             try:
                 consent_elements = self.driver.find_elements(By.CSS_SELECTOR, "[title='SP Consent Message']")
@@ -54,6 +53,7 @@ class Independent:
             except:
                 self.helper.log("Failed to find cookie disclaimer")
 
+        @self.helper.timed()
         def check_google_ad():
             try:
                 ad_frame_elements = self.driver.find_elements(By.CSS_SELECTOR, "[title='3rd party ad content']")
@@ -66,6 +66,7 @@ class Independent:
             except:
                 self.helper.log("Failed to find Google ad")
 
+        @self.helper.timed()
         def check_subscribe_modal():
             try:
                 for i in range(10):
@@ -81,42 +82,19 @@ class Independent:
             except:
                 self.helper.log("Failed to close subscribe modal")
 
+        @self.helper.timed()
         def save_element_image(element, file):
-            location = element.location_once_scrolled_into_view
-            png = self.driver.get_screenshot_as_png() # saves screenshot of entire page
-
-            im = Image.open(BytesIO(png)) # uses PIL library to open image in memory
-
-            left = location['x']
-            top = location['y']
-            
-            size = self.driver.execute_script("var element = arguments[0]; return [element.offsetWidth, element.offsetHeight]", element)
-            width = size[0]
-            height = size[1]
-
-            if width == 0 or height == 0:
+            im = self.helper.sync_element_screenshot(element)
+            if im == None:
                 return False
 
-            right = left + width
-            bottom = top + height
-
-            im = im.crop((left, top, right, bottom))
-
-            def trim(im):
-                bg = Image.new(im.mode, im.size, (255, 255, 255))
-                diff = ImageChops.difference(im, bg)
-                diff = ImageChops.add(diff, diff, 2.0, -100)
-                bbox = diff.getbbox()
-                if bbox:
-                    return im.crop(bbox)
-                else:
-                    return trim(im.convert('RGB'))
-            
-            trim(im).save(file)
+            self.helper.save_image(im, file, trim=True)
             return True
 
+        @self.helper.timed()
         def save_articles():
             self.helper.log("Saving articles")
+            self.helper.sync_prefetch_known_reports()
 
             articles = self.driver.find_elements(By.CSS_SELECTOR, ".article-default")
 
@@ -144,8 +122,8 @@ class Independent:
                     except:
                         article_data["section_url"] = None
 
-                    report = self.helper.sync_report(article_id, article_data)
-                    self.helper.log("Inserted report %s: %s" % (article_id, report.inserted_id))
+                    report_id = self.helper.sync_report(article_id, article_data)
+                    self.helper.log("Queued report %s: %s" % (article_id, report_id))
                 else:
                     self.helper.sync_insert_presence(article_db_obj.get('_id'), datetime.datetime.utcnow())
                     self.helper.log("Inserted presence into %s" % article_id)
@@ -159,7 +137,7 @@ class Independent:
             self.helper.scroll_down_page()
             save_articles()
         except Exception as e:
-            self.helper.log("Failed waiting for site: %s" % (str(e)), exception=traceback.format_exc())
+            self.helper.log("Failed waiting for site: %s" % (str(e)), exception=traceback.format_exc(), fatal=True)
             self.helper.log("Shutting down")
         finally:
             self.helper.stop()
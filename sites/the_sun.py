@@ -1,6 +1,4 @@
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.action_chains import ActionChains
 
@@ -26,20 +24,23 @@ class TheSun:
             self.xdotool.size("100%", "100%")
         except Exception as e:
             exception_str = traceback.format_exc()
-            self.helper.log("Failed during setup", exception=exception_str)
+            self.helper.log("Failed during setup", exception=exception_str, fatal=True)
             self.helper.stop()
             return
             
         self.helper.log("Fetching The Sun")
 
+        @self.helper.timed()
         def navigate():
             self.helper.log("Navigating to page: %s" % (self.url))
             self.driver.get(self.url)
 
+        @self.helper.timed()
         def wait_for_page_ready(interval):
             self.helper.log("Waiting for page")
-            WebDriverWait(self.driver, interval).until(EC.presence_of_element_located((By.ID, "main-content")))
+            self.helper.sync_wait_until_ready((By.ID, "main-content"), interval)
 
+        @self.helper.timed()
         def check_cookie_disclaimer():
             try:
                 consent_elements = self.driver.find_elements(By.CSS_SELECTOR, "[title='SP Consent Message']")
@@ -52,30 +53,20 @@ class TheSun:
             except:
                 self.helper.log("Failed to find cookie disclaimer")
 
+        @self.helper.timed()
         def save_element_image(element, file):
-            location = element.location_once_scrolled_into_view
-            png = self.driver.get_screenshot_as_png() # saves screenshot of entire page
-
-            im = Image.open(BytesIO(png)) # uses PIL library to open image in memory
-
-            left = location['x']
-            top = location['y']
-            
-            size = self.driver.execute_script("var element = arguments[0]; var b = window.getComputedStyle(element); return [b.width, b.height]", element)
-            width = int(float(size[0].replace("px", "")))
-            height = int(float(size[1].replace("px", "")))
-
-            right = left + width
-            bottom = top + height
-
-            im = im.crop((left, top, right, bottom))
-            im.save(file)
+            im = self.helper.sync_element_screenshot(element, computed_size=True)
+            if im == None:
+                return False
+            self.helper.save_image(im, file)
 
+        @self.helper.timed()
         def save_articles():
             self.helper.log("Saving articles")
             header = self.driver.find_element(By.CSS_SELECTOR, "#react-root > div > .sun-container > .theme-main:first-of-type")
             self.driver.execute_script("var element = arguments[0]; element.parentNode.removeChild(element);", header)
 
+            self.helper.sync_prefetch_known_reports("[data-id]", attribute="data-id")
             articles = self.driver.find_elements(By.CSS_SELECTOR, "[data-id]")
             for article in articles:
                 article_id = article.get_attribute("data-id")
@@ -128,8 +119,8 @@ class TheSun:
                     except:
                         article_data["video"] = False
                             
-                    report = self.helper.sync_report(article_id, article_data)
-                    self.helper.log("Inserted report %s: %s" % (article_id, report.inserted_id))
+                    report_id = self.helper.sync_report(article_id, article_data)
+                    self.helper.log("Queued report %s: %s" % (article_id, report_id))
                 else:
                     self.helper.sync_insert_presence(article_db_obj.get('_id'), datetime.datetime.utcnow())
                     self.helper.log("Inserted presence into %s" % article_id)
@@ -141,7 +132,7 @@ class TheSun:
             self.helper.scroll_down_page()
             save_articles()
         except Exception as e:
-            self.helper.log("Failed waiting for site: %s" % (str(e)), exception=traceback.format_exc())
+            self.helper.log("Failed waiting for site: %s" % (str(e)), exception=traceback.format_exc(), fatal=True)
             self.helper.log("Shutting down")
         finally:
             self.helper.stop()
\ No newline at end of file
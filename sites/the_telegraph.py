@@ -1,6 +1,4 @@
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.action_chains import ActionChains
 
@@ -10,7 +8,6 @@ import base64
 import os
 import datetime
 import hashlib
-import time
 import traceback
 
 class TheTelegraph:
@@ -27,20 +24,23 @@ class TheTelegraph:
             self.xdotool.size("100%", "100%")
         except Exception as e:
             exception_str = traceback.format_exc()
-            self.helper.log("Failed during setup", exception=exception_str)
+            self.helper.log("Failed during setup", exception=exception_str, fatal=True)
             self.helper.stop()
             return
 
         self.helper.log("Fetching The Telegraph")
 
+        @self.helper.timed()
         def navigate():
             self.helper.log("Navigating to page: %s" % (self.url))
             self.driver.get(self.url)
 
+        @self.helper.timed()
         def wait_for_page_ready(interval):
             self.helper.log("Waiting for page")
-            WebDriverWait(self.driver, interval).until(EC.presence_of_element_located((By.ID, "main-content")))
+            self.helper.sync_wait_until_ready((By.ID, "main-content"), interval)
 
+        @self.helper.timed()
         def check_cookie_disclaimer():
             try:
                 consent_elements = self.driver.find_elements(By.CSS_SELECTOR, "[title='SP Consent Message']")
@@ -52,6 +52,7 @@ class TheTelegraph:
             except:
                 self.helper.log("Failed to find cookie disclaimer")
         
+        @self.helper.timed()
         def check_subscribe_modal():
             try:
                 close_modal_button = self.driver.find_element(By.CSS_SELECTOR, ".martech-modal-component__close")
@@ -61,41 +62,31 @@ class TheTelegraph:
             except:
                 self.helper.log("Failed to find subscribe modal")
 
+        @self.helper.timed()
         def save_element_image(element, file, sibling_check=False):
-            location = element.location_once_scrolled_into_view
-            png = self.driver.get_screenshot_as_png() # saves screenshot of entire page
-
-            im = Image.open(BytesIO(png)) # uses PIL library to open image in memory
-
-            left = location['x']
-            top = location['y']
-            
-            size = self.driver.execute_script("var element = arguments[0]; var b = window.getComputedStyle(element); return [b.width, b.height]", element)
-            width = int(float(size[0].replace("px", "")))
-            height = int(float(size[1].replace("px", "")))
+            elements = [element]
 
             if sibling_check:
                 try:
                     next_sibling = self.driver.execute_script("return arguments[0].nextElementSibling", element)
                     if next_sibling != None and "package__image" in next_sibling.get_attribute("class"):
-                        next_sibling_location = next_sibling.location_once_scrolled_into_view
-                        next_sibling_size = self.driver.execute_script("var element = arguments[0]; var b = window.getComputedStyle(element); return [b.width, b.height]", next_sibling)
-                        next_sibling_width = int(float(next_sibling_size[0].replace("px", "")))
-                        next_sibling_height = int(float(next_sibling_size[1].replace("px", "")))
-
-                        width = (next_sibling_location["x"] - left) + next_sibling_width
-                        height = (next_sibling_location["y"] - top) + next_sibling_height
+                        elements.append(next_sibling)
                 except Exception as e:
                     self.helper.log("Failed to get sibling image: %s" % (str(e)))
 
+            # measured together, so scrolling to one cannot leave the other's position stale
+            left, top, width, height = self.helper.sync_elements_rect(elements, computed_size=True)
+
             right = left + width
             bottom = top + height
 
-            im = im.crop((left, top, right, bottom))
-            im.save(file)
+            im = self.helper.sync_region_screenshot((left, top, right, bottom))
+            self.helper.save_image(im, file)
 
+        @self.helper.timed()
         def save_articles():
             self.helper.log("Saving articles")
+            self.helper.sync_prefetch_known_reports()
 
             packages = self.driver.find_elements(By.CSS_SELECTOR, ".package")
             for package in packages:
@@ -133,8 +124,8 @@ class TheTelegraph:
                             article_data["standfirst"] = card_meta_text if card_meta_text != "" else None
                         except:
                             pass
-                        report = self.helper.sync_report(article_id, article_data)
-                        self.helper.log("Inserted report %s: %s" % (article_id, report.inserted_id))
+                        report_id = self.helper.sync_report(article_id, article_data)
+                        self.helper.log("Queued report %s: %s" % (article_id, report_id))
                     else:
                         self.helper.sync_insert_presence(article_db_obj.get('_id'), datetime.datetime.utcnow())
                         self.helper.log("Inserted presence into %s" % article_id)
@@ -196,8 +187,8 @@ class TheTelegraph:
                             article_data["standfirst"] = card_standfirst_text if card_standfirst_text != "" else None
                         except:
                             article_data["standfirst"] = None
-                        report = self.helper.sync_report(article_id, article_data)
-                        self.helper.log("Inserted report %s: %s" % (article_id, report.inserted_id))
+                        report_id = self.helper.sync_report(article_id, article_data)
+                        self.helper.log("Queued report %s: %s" % (article_id, report_id))
                     else:
                         self.helper.sync_insert_presence(article_db_obj.get('_id'), datetime.datetime.utcnow())
                         self.helper.log("Inserted presence into %s" % article_id)
@@ -206,13 +197,13 @@ class TheTelegraph:
             navigate()
             wait_for_page_ready(self.helper.interval_page_ready())
             check_cookie_disclaimer()
-            time.sleep(2)
+            self.helper.sync_wait_for_network_idle()
             check_subscribe_modal()
-            time.sleep(2)
+            self.helper.sync_wait_for_network_idle()
             self.helper.scroll_down_page()
             save_articles()
         except Exception as e:
-            self.helper.log("Failed waiting for site: %s" % (str(e)), exception=traceback.format_exc())
+            self.helper.log("Failed waiting for site: %s" % (str(e)), exception=traceback.format_exc(), fatal=True)
             self.helper.log("Shutting down")
         finally:
             self.helper.stop()
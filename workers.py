@@ -0,0 +1,234 @@
+import os
+import datetime
+import itertools
+import multiprocessing
+import queue
+import threading
+import traceback
+
+from concurrent.futures import Future
+
+from bson.objectid import ObjectId
+
+from runmetrics import kill_descendants, get_descendants, kill_processes
+
+# imported by the forkserver once, so every worker forked from it starts with them loaded
+PRELOAD_MODULES = ["helper", "siteloader", "selenium.webdriver", "PIL.Image", "numpy", "pymongo"]
+
+def worker_main(worker_index, configuration, helper_arguments, browser_pool_arguments, task_queue, result_queue):
+    from pymongo import MongoClient
+
+    from helper import Helper
+    from logsink import LogSink
+    from browserpool import BrowserPool
+    from siteloader import load_site_class
+    from buildutil import get_build_root
+    from profiling import RunProfiler
+
+    # one connection pool per worker, created after the fork
+    sync_mongodb_client = MongoClient(configuration["database_url"])
+    sync_mongodb_database = sync_mongodb_client[configuration["database_name"]]
+    log_sink = LogSink(sync_mongodb_database["log"])
+    source = "worker-%d" % worker_index
+
+    def log(line, exception=None):
+        log_line = {"_id": ObjectId(), "date": datetime.datetime.utcnow(), "source": source, "text": line}
+        if exception != None:
+            log_line["exception"] = exception
+        log_sink.put(log_line)
+        print("[%s] [%s] %s" % (source, log_line["date"], line))
+
+    browser_pool = None
+    if browser_pool_arguments != None:
+        browser_pool = BrowserPool(log_func=log, **browser_pool_arguments)
+    log("Worker started (pid %d)" % os.getpid())
+
+    while True:
+        task = task_queue.get()
+        if task == None:
+            break
+
+        run_identifier, site_identifier, site_configuration = task
+        outcome = "error"
+        site_helper = None
+        profiler = None
+        if site_configuration.get("profile", False):
+            profiler = RunProfiler()
+            profiler.start()
+        try:
+            site_class = load_site_class(os.path.join(get_build_root(), site_configuration["path"]), site_configuration["class"])
+            site_helper = Helper(site_identifier,
+                site_configuration["name"],
+                sync_mongodb_database,
+                options=site_configuration.get("options", {}),
+                browser_pool=browser_pool,
+                # two workers may each hold an idle browser for the same site, so they cannot share a profile
+                profile_suffix=(str(worker_index) if browser_pool != None else None),
+                **helper_arguments)
+            site_object = site_class(site_helper)
+            site_object.start()
+            outcome = site_helper.get_outcome()
+        except Exception as e:
+            log("Worker caught an error on site '%s': %s" % (site_identifier, str(e)), exception=traceback.format_exc())
+        finally:
+            if profiler != None:
+                profiler.stop()
+                if site_helper != None:
+                    site_helper.save_profile(profiler)
+            if site_helper != None:
+                site_helper.sync_record_run(outcome)
+            log("Worker finished site '%s'" % site_identifier)
+            log_sink.flush()
+            result_queue.put((run_identifier, worker_index, outcome))
+
+    if browser_pool != None:
+        browser_pool.close()
+    log_sink.close()
+    sync_mongodb_client.close()
+
+class Worker:
+    def __init__(self, index, process, task_queue):
+        self.index = index
+        self.process = process
+        self.task_queue = task_queue
+        self.run_identifier = None
+        self.last_site = None
+        # once a worker has died its children are reparented and cannot be found from its pid anymore
+        self.descendants = []
+
+class WorkerPool:
+    def __init__(self, size, configuration, helper_arguments, browser_pool_arguments=None, start_method=None, log_func=print, completion_callback=None):
+        if start_method == None:
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self.context = multiprocessing.get_context(start_method)
+        if start_method == "forkserver":
+            self.context.set_forkserver_preload(PRELOAD_MODULES)
+
+        self.size = size
+        self.configuration = configuration
+        self.helper_arguments = helper_arguments
+        self.browser_pool_arguments = browser_pool_arguments
+        self.log_func = log_func
+        self.completion_callback = completion_callback
+        self.result_queue = self.context.Queue()
+        self.workers = []
+        self.runs = {}
+        self.pending = []
+        self.run_counter = itertools.count()
+        self.lock = threading.Lock()
+        self.running = True
+
+        for index in range(size):
+            self.workers.append(self.start_worker(index))
+
+        self.collector = threading.Thread(target=self.collect, daemon=True)
+        self.collector.start()
+
+    def start_worker(self, index):
+        task_queue = self.context.Queue()
+        process = self.context.Process(target=worker_main,
+            args=(index, self.configuration, self.helper_arguments, self.browser_pool_arguments, task_queue, self.result_queue))
+        process.start()
+        return Worker(index, process, task_queue)
+
+    def submit(self, site_identifier, site_configuration):
+        future = Future()
+        run_identifier = next(self.run_counter)
+        with self.lock:
+            self.runs[run_identifier] = (site_identifier, site_configuration, future)
+            self.pending.append(run_identifier)
+            self.dispatch()
+        return future
+
+    def dispatch(self):
+        # prefer the idle worker that ran the site last, it may still hold a warm browser for it
+        for run_identifier in list(self.pending):
+            site_identifier, site_configuration, future = self.runs[run_identifier]
+            idle_workers = [worker for worker in self.workers if worker.run_identifier == None]
+            if len(idle_workers) == 0:
+                return
+            idle_workers.sort(key=lambda worker: worker.last_site != site_identifier)
+            worker = idle_workers[0]
+            worker.run_identifier = run_identifier
+            worker.last_site = site_identifier
+            self.pending.remove(run_identifier)
+            worker.task_queue.put((run_identifier, site_identifier, site_configuration))
+
+    def finish(self, worker, outcome):
+        run_identifier = worker.run_identifier
+        worker.run_identifier = None
+        if run_identifier == None or not run_identifier in self.runs:
+            return
+        site_identifier, site_configuration, future = self.runs.pop(run_identifier)
+        future.set_result(outcome)
+        if self.completion_callback != None:
+            self.completion_callback()
+
+    def collect(self):
+        while self.running:
+            try:
+                run_identifier, worker_index, outcome = self.result_queue.get(timeout=1)
+                with self.lock:
+                    worker = self.workers[worker_index]
+                    if worker.run_identifier == run_identifier:
+                        self.finish(worker, outcome)
+                    self.dispatch()
+            except queue.Empty:
+                pass
+
+            with self.lock:
+                self.replace_dead_workers()
+
+    def replace_dead_workers(self):
+        if not self.running:
+            return
+        for index, worker in enumerate(self.workers):
+            if worker.process.is_alive():
+                worker.descendants = get_descendants(worker.process.pid)
+                continue
+            self.log_func("Worker %d exited with code %s, starting a replacement" % (index, str(worker.process.exitcode)))
+            killed = kill_processes(worker.descendants)
+            if killed > 0:
+                self.log_func("Killed %d processes left behind by worker %d" % (killed, index))
+            self.finish(worker, "crashed")
+            self.workers[index] = self.start_worker(index)
+        self.dispatch()
+
+    def find_worker(self, future):
+        for worker in self.workers:
+            if worker.run_identifier in self.runs and self.runs[worker.run_identifier][2] is future:
+                return worker
+        return None
+
+    def get_pid(self, future):
+        with self.lock:
+            worker = self.find_worker(future)
+            if worker == None:
+                return None
+            return worker.process.pid
+
+    def terminate(self, future):
+        with self.lock:
+            worker = self.find_worker(future)
+            if worker == None:
+                return False
+            # the worker's browser pool would otherwise be orphaned along with the running site's browser
+            killed = kill_descendants(worker.process.pid)
+            if killed > 0:
+                self.log_func("Killed %d child processes of worker %d" % (killed, worker.index))
+            worker.process.kill()
+            worker.process.join(5)
+            self.finish(worker, "terminated")
+            self.workers[worker.index] = self.start_worker(worker.index)
+            self.dispatch()
+        return True
+
+    def close(self):
+        self.running = False
+        for worker in self.workers:
+            worker.task_queue.put(None)
+        for worker in self.workers:
+            worker.process.join(30)
+            if worker.process.is_alive():
+                worker.process.kill()
+        self.collector.join(5)
@@ -2,21 +2,27 @@ import os
 import subprocess
 
 class XdotoolWrapper:
-    def __init__(self, display, uuid):
+    def __init__(self, display, uuid=None, pid=None):
         self.display = display
         self.uuid = uuid
+        self.pid = pid
         self.xdotool_env = os.environ.copy()
         self.xdotool_env["DISPLAY"] = display
-        searched_window = self._exec(["search", str(uuid)])
-        self.window_id = int(searched_window.stdout.readline().strip())
+        if uuid != None:
+            searched_window = self._exec(["search", str(uuid)])
+        else:
+            searched_window = self._exec(["search", "--sync", "--onlyvisible", "--pid", str(pid)])
+        self.window_id = int(searched_window.stdout.strip().splitlines()[0])
 
     def _exec(self, arguments):
-        return subprocess.Popen(
+        # waits for xdotool to exit so finished processes are reaped instead of piling up
+        return subprocess.run(
             ["xdotool", *arguments],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            text=True,
             close_fds=True,
+            timeout=30,
             env=self.xdotool_env
         )
 
@@ -31,3 +37,6 @@ class XdotoolWrapper:
 
     def size(self, width, height):
         return self._exec(["windowsize", str(self.window_id), str(width), str(height)])
+
+    def close(self):
+        pass
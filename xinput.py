@@ -0,0 +1,111 @@
+import time
+
+try:
+    from Xlib import X, XK
+    from Xlib.display import Display
+    from Xlib.ext import xtest
+    from Xlib.error import XError
+    xlib_available = True
+except ImportError:
+    xlib_available = False
+
+from xdotool import XdotoolWrapper
+
+class WindowNotFoundException(Exception):
+    pass
+
+def parse_size(value, total):
+    # accepts pixels or a percentage of the screen, like xdotool windowsize
+    value = str(value)
+    if value.endswith("%"):
+        return int(total * float(value[:-1]) / 100)
+    return int(value)
+
+class XlibInput:
+    # one X connection for the life of the browser, input goes through XTest instead of an xdotool process per action
+    def __init__(self, display, pid, timeout=10):
+        self.display_name = display
+        self.pid = pid
+        self.display = Display(display)
+        self.screen = self.display.screen()
+        self.net_wm_pid = self.display.intern_atom("_NET_WM_PID")
+        self.window = self.find_window(timeout)
+        self.window_id = self.window.id
+        self.pointer_inside = False
+
+    def find_window(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            window = self.search_window(self.screen.root)
+            if window != None:
+                return window
+            if time.time() > deadline:
+                raise WindowNotFoundException("No window for pid %d on display %s" % (self.pid, self.display_name))
+            time.sleep(0.1)
+
+    def search_window(self, root):
+        # chrome sets _NET_WM_PID on its top-level windows, the largest viewable one is the browser window
+        best_window = None
+        best_area = 0
+        windows = [root]
+        while len(windows) > 0:
+            window = windows.pop()
+            try:
+                for child in window.query_tree().children:
+                    windows.append(child)
+                    pid = child.get_full_property(self.net_wm_pid, X.AnyPropertyType)
+                    if pid == None or not self.pid in pid.value:
+                        continue
+                    if child.get_attributes().map_state != X.IsViewable:
+                        continue
+                    geometry = child.get_geometry()
+                    if geometry.width * geometry.height > best_area:
+                        best_window = child
+                        best_area = geometry.width * geometry.height
+            except XError:
+                pass
+        return best_window
+
+    def move_pointer_inside(self):
+        geometry = self.window.get_geometry()
+        position = self.screen.root.translate_coords(self.window, geometry.width // 2, geometry.height // 2)
+        xtest.fake_input(self.display, X.MotionNotify, x=position.x, y=position.y)
+        self.pointer_inside = True
+
+    def activate(self):
+        self.window.raise_window()
+        self.window.set_input_focus(X.RevertToParent, X.CurrentTime)
+        self.move_pointer_inside()
+        self.display.sync()
+
+    def scroll_down(self):
+        if not self.pointer_inside:
+            self.move_pointer_inside()
+        xtest.fake_input(self.display, X.ButtonPress, 5)
+        xtest.fake_input(self.display, X.ButtonRelease, 5)
+        self.display.sync()
+
+    def page_up(self):
+        keycode = self.display.keysym_to_keycode(XK.string_to_keysym("Page_Up"))
+        xtest.fake_input(self.display, X.KeyPress, keycode)
+        xtest.fake_input(self.display, X.KeyRelease, keycode)
+        self.display.sync()
+
+    def size(self, width, height):
+        self.window.configure(width=parse_size(width, self.screen.width_in_pixels), height=parse_size(height, self.screen.height_in_pixels))
+        self.pointer_inside = False
+        self.display.sync()
+
+    def close(self):
+        try:
+            self.display.close()
+        except Exception:
+            pass
+
+def create_input(display, pid, log_func=print):
+    if xlib_available and pid != None:
+        try:
+            return XlibInput(display, pid)
+        except Exception as e:
+            log_func("XTest input unavailable, falling back to xdotool: %s" % str(e))
+    return XdotoolWrapper(display, pid=pid)